@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Author : Kai
+Date   : 2026-10-18
+Purpose: Throughput benchmarks for nc_name.py and qname.py
+
+Converts the production unit code list and the test csvs and reports codes per second
+for each stage (parse, label, definition, mapping lookup, serialization), using the
+input dicts and mappings shipped with the repo. Every run is appended as one json line
+to output/benchmarks/results.jsonl tagged with the git commit, so throughput can be
+followed over time. Runs offline, only needs the packages nc_name.py already uses.
+
+Run:
+./benchmark.py
+./benchmark.py -g earley lalr lalr-inline -r 5
+./benchmark.py -c data/production/working_pooled_unit_codes.csv --no-fast-path --no-qname
+
+"""
+
+import argparse
+import contextlib
+import datetime
+import glob
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import csv
+import time
+import warnings
+
+import nc_name
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(script_dir)
+qname_dir = os.path.join(repo_dir, 'qname_processing')
+
+default_corpora = [os.path.join('data', 'production', 'working_pooled_unit_codes.csv')] + \
+    sorted(os.path.relpath(f, script_dir) for f in glob.glob(os.path.join(script_dir, 'data', 'test', '*.csv')))
+
+# nc_name.py --profile stages making up each reported stage
+stage_groups = {
+    'parse': ['lookup', 'parse', 'compile'],
+    'label': ['si_symbols', 'labels', 'sort', 'label'],
+    'definition': ['definition'],
+    'codes': ['codes'],
+    'mapping': ['mapping'],
+    'serialize': ['serialize'],
+}
+
+
+# --------------------------------------------------
+def get_args():
+    """get command-line arguments"""
+    parser = argparse.ArgumentParser(
+        description='Throughput benchmarks for nc_name.py and qname.py',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument(
+        '-c',
+        '--corpus',
+        help='Input csv files of unit codes, relative to this script',
+        metavar='str',
+        type=str,
+        nargs='+',
+        default=default_corpora)
+
+    parser.add_argument(
+        '-g',
+        '--parsers',
+        help='nc_name.py parsers to benchmark',
+        metavar='str',
+        type=str,
+        nargs='+',
+        choices=['earley', 'lalr', 'lalr-inline'],
+        default=['earley'])
+
+    parser.add_argument(
+        '-r',
+        '--repeat',
+        help='Times each corpus is converted, the fastest time of each stage is kept',
+        metavar='int',
+        type=int,
+        default=3)
+
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='Results file, one json line is appended per run',
+        metavar='str',
+        type=str,
+        default=os.path.join(script_dir, 'output', 'benchmarks', 'results.jsonl'))
+
+    parser.add_argument(
+        '-s',
+        '--SI',
+        help='SI units dict used by nc_name.py',
+        metavar='str',
+        type=str,
+        default=nc_name.default_SI_file)
+
+    parser.add_argument(
+        '--no-fast-path',
+        help='Parse every code with the grammar instead of resolving simple codes from the component table',
+        action='store_true')
+
+    parser.add_argument(
+        '--no-qname',
+        help='Skip the qname.py benchmark',
+        action='store_true')
+
+    return parser.parse_args()
+
+
+# --------------------------------------------------
+def git_commit():
+    """Current commit of the repo and whether tracked files have changes, (None, None) outside git"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo_dir,
+                                capture_output=True, text=True, check=True).stdout
+    except (subprocess.CalledProcessError, OSError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+# --------------------------------------------------
+def throughput(codes, seconds):
+    """Stage entry of the results"""
+    return {'codes': codes, 'seconds': seconds, 'codes_per_second': codes / seconds if seconds else None}
+
+
+# --------------------------------------------------
+def best_stages(runs):
+    """Keep the fastest time of each stage over repeated runs"""
+    best = {}
+    for run in runs:
+        for stage, (codes, seconds) in run.items():
+            if stage not in best or seconds < best[stage][1]:
+                best[stage] = (codes, seconds)
+    return {stage: throughput(codes, seconds) for stage, (codes, seconds) in best.items()}
+
+
+# --------------------------------------------------
+def bench_nc_name(codes, SI_file, parser, fast_path, repeat):
+    """Convert codes with a ConversionContext and time each stage with a StageProfiler"""
+    start = time.perf_counter()
+    context = nc_name.ConversionContext(SI_file=SI_file, parser=parser, fast_path=fast_path)
+    setup_seconds = time.perf_counter() - start
+
+    runs = []
+    failed = 0
+    for _ in range(repeat):
+        profiler = nc_name.StageProfiler()
+        context.profiler = profiler
+        failed = 0
+        # Conversion messages aren't part of the benchmark output
+        with contextlib.redirect_stdout(io.StringIO()):
+            for code in codes:
+                record, error = context.convert_with_error(code)
+                if error is not None:
+                    # e.g. units missing a label in the SI dict, left out of the timings
+                    profiler.code_stages.pop(code, None)
+                    failed += 1
+                    continue
+                start = time.perf_counter()
+                nc_name.format_record_ttl(record)
+                profiler.add(code, 'serialize', time.perf_counter() - start)
+
+        run = {}
+        for stage, profile_stages in stage_groups.items():
+            stage_times = [sum(stages.get(s, 0.0) for s in profile_stages)
+                           for stages in profiler.code_stages.values()
+                           if any(s in stages for s in profile_stages)]
+            if stage_times:
+                run[stage] = (len(stage_times), sum(stage_times))
+        run['total'] = (len(profiler.code_stages), sum(sum(stages.values()) for stages in profiler.code_stages.values()))
+        runs.append(run)
+
+    return {'script': 'nc_name', 'parser': parser, 'fast_path': fast_path, 'setup_seconds': setup_seconds,
+            'failed': failed, 'stages': best_stages(runs)}
+
+
+# --------------------------------------------------
+def load_qname():
+    """Import qname.py from qname_processing/ and load its mapping files as its main() does"""
+    spec = importlib.util.spec_from_file_location('qname', os.path.join(qname_dir, 'qname.py'))
+    qname = importlib.util.module_from_spec(spec)
+    # qname.py compares strings with "is", keep its SyntaxWarnings out of the report
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', SyntaxWarning)
+        spec.loader.exec_module(qname)
+
+    mapping_lists = {}
+    for name in ['om', 'qudt', 'uo', 'oboe']:
+        with open(os.path.join(qname_dir, 'input_mappings', 'UCUM', f'{name}_ucum_mapping.csv'),
+                  mode='r', encoding='utf-8-sig') as csvfile:
+            mapping_lists[name] = list(csv.DictReader(csvfile))
+    with open(os.path.join(qname_dir, 'input_mappings', 'QName', 'qname_labels.csv'),
+              mode='r', encoding='utf-8-sig') as csvfile:
+        vocab = qname.build_qname_vocab(list(csv.DictReader(csvfile)))
+    return qname, mapping_lists, vocab
+
+
+# --------------------------------------------------
+def bench_qname(codes, qname_setup, repeat):
+    """Time qname.py parsing, label generation and the whole qname() call per code"""
+    qname, mapping_lists, vocab, setup_seconds = qname_setup
+    ontology_mapping_list = mapping_lists['om'] + mapping_lists['qudt'] + mapping_lists['uo'] + mapping_lists['oboe']
+
+    runs = []
+    failed = 0
+    for _ in range(repeat):
+        parse_seconds = label_seconds = total_seconds = 0.0
+        done = 0
+        failed = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for code in codes:
+                try:
+                    t0 = time.perf_counter()
+                    in_str = qname.reformat_backslash(code)
+                    qname_str = qname.ucum_to_qname(in_str, vocab)
+                    t1 = time.perf_counter()
+                    qname.gen_qname_label(qname_str, vocab)
+                    t2 = time.perf_counter()
+                    qname.qname(in_str, ontology_mapping_list, mapping_lists['om'], mapping_lists['qudt'],
+                                mapping_lists['uo'], mapping_lists['oboe'], vocab)
+                    t3 = time.perf_counter()
+                except Exception:
+                    failed += 1
+                    continue
+                parse_seconds += t1 - t0
+                label_seconds += t2 - t1
+                # qname() parses and labels again, total is the whole call
+                total_seconds += t3 - t2
+                done += 1
+        runs.append({'parse': (done, parse_seconds), 'label': (done, label_seconds), 'total': (done, total_seconds)})
+
+    return {'script': 'qname', 'setup_seconds': setup_seconds, 'failed': failed, 'stages': best_stages(runs)}
+
+
+# --------------------------------------------------
+def print_result(result):
+    """One line per stage of a benchmark result"""
+    name = result['script'] + (' ' + result['parser'] if 'parser' in result else '')
+    if result.get('fast_path') is False:
+        name += ' (no fast path)'
+    print(f"  {name}, setup {result['setup_seconds']:.3f}s, {result['failed']} codes failed")
+    for stage, t in result['stages'].items():
+        rate = '{:>12,.0f}'.format(t['codes_per_second']) if t['codes_per_second'] else '{:>12}'.format('-')
+        print(f"    {stage:<12}{t['codes']:>8} codes {t['seconds']:>9.4f}s {rate} codes/s")
+
+
+# --------------------------------------------------
+def main():
+    """Run the benchmarks and append the results"""
+    args = get_args()
+    commit, dirty = git_commit()
+
+    qname_setup = None
+    if not args.no_qname:
+        start = time.perf_counter()
+        qname_setup = load_qname() + (time.perf_counter() - start,)
+
+    results = []
+    for corpus in args.corpus:
+        codes = list(nc_name.read_input_codes(os.path.join(script_dir, corpus)))
+        print(f'{corpus}: {len(codes)} codes')
+        for parser in args.parsers:
+            result = bench_nc_name(codes, args.SI, parser, not args.no_fast_path, args.repeat)
+            result['corpus'] = corpus
+            print_result(result)
+            results.append(result)
+        if not args.no_qname:
+            result = bench_qname(codes, qname_setup, args.repeat)
+            result['corpus'] = corpus
+            print_result(result)
+            results.append(result)
+
+    entry = {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'dirty': dirty,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, mode='a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    print(f"Results for commit {commit or 'unknown'}{' (with local changes)' if dirty else ''} appended to {args.output}")
+
+
+# --------------------------------------------------
+if __name__ == '__main__':
+    main()
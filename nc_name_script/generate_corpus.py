@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Author : Kai
+Date   : 2026-10-18
+Purpose: Generate synthetic UCUM unit code corpora for scaling and stress tests
+
+Codes are built from the units in the SI dict, the prefixes and exponents files and the
+conventional terminals of the nc_name.py grammar. Valid codes join --min-components to
+--max-components components with "." or "/", invalid codes are valid ones broken in one
+of the ways listed in invalid_kinds. Valid codes using a conventional terminal with no
+SI dict entry parse but can't be converted with that dict, --labels marks them
+valid:no_dict_entry and --dict-only leaves those terminals out. The same --seed and
+options always give the same corpus, rows are written as they are generated so any
+size from 10^3 to 10^7 codes can be written in constant memory. The csv has the code in
+the first column like data/production/working_pooled_unit_codes.csv, so it can be
+passed to nc_name.py -d, qname.py -i or benchmark.py -c as is.
+
+Run:
+./generate_corpus.py -n 1000 -o data/synthetic/corpus_1e3.csv
+./generate_corpus.py -n 10000000 --seed 7 -o data/synthetic/corpus_1e7.csv
+Long compound codes with large exponents, a fifth of them invalid, with a column saying which:
+./generate_corpus.py -n 100000 --min-components 6 --max-components 12 --max-exponent 20 --invalid-rate 0.2 --labels -o data/synthetic/long.csv
+
+"""
+
+import argparse
+import csv
+import os
+import random
+
+import nc_name
+
+# Ways an invalid code is broken, see break_code()
+invalid_kinds = ['unknown_unit', 'numeric_factor', 'empty_component', 'trailing_operator',
+                 'prefixed_conventional', 'unbalanced_bracket', 'dangling_sign']
+
+
+# --------------------------------------------------
+def get_args():
+    """get command-line arguments"""
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic UCUM unit code corpora',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument(
+        '-n',
+        '--size',
+        help='Number of codes to write',
+        metavar='int',
+        type=int,
+        default=1000)
+
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='Output csv file',
+        metavar='str',
+        type=str,
+        default='corpus.csv')
+
+    parser.add_argument(
+        '--seed',
+        help='Random seed, the same seed and options give the same corpus',
+        metavar='int',
+        type=int,
+        default=0)
+
+    parser.add_argument(
+        '-s',
+        '--SI',
+        help='Input SI units dict',
+        metavar='str',
+        type=str,
+        default=nc_name.default_SI_file)
+
+    parser.add_argument(
+        '-p',
+        '--prefix',
+        help='Input prefixes file',
+        metavar='str',
+        type=str,
+        default=nc_name.default_prefix_file)
+
+    parser.add_argument(
+        '-e',
+        '--exponents',
+        help='Input exponents file',
+        metavar='str',
+        type=str,
+        default=nc_name.default_exponents_file)
+
+    parser.add_argument(
+        '--min-components',
+        help='Fewest components in a code',
+        metavar='int',
+        type=int,
+        default=1)
+
+    parser.add_argument(
+        '--max-components',
+        help='Most components in a code',
+        metavar='int',
+        type=int,
+        default=4)
+
+    parser.add_argument(
+        '--max-exponent',
+        help='Largest exponent used, defaults to the largest power in the exponents file',
+        metavar='int',
+        type=int,
+        default=None)
+
+    parser.add_argument(
+        '--conventional-rate',
+        help='Share of components using a conventional terminal of the grammar',
+        metavar='float',
+        type=float,
+        default=0.1)
+
+    parser.add_argument(
+        '--slash-rate',
+        help='Share of valid codes written with "/" e.g. kg/m/s2 rather than kg.m-1.s-2',
+        metavar='float',
+        type=float,
+        default=0.3)
+
+    parser.add_argument(
+        '--invalid-rate',
+        help='Share of codes that are broken on purpose',
+        metavar='float',
+        type=float,
+        default=0.1)
+
+    parser.add_argument(
+        '--labels',
+        help='Add a second column with valid, valid:no_dict_entry or invalid:<kind> for each code',
+        action='store_true')
+
+    parser.add_argument(
+        '--dict-only',
+        help='Only use conventional terminals with an SI dict entry, so every valid code converts',
+        action='store_true')
+
+    args = parser.parse_args()
+    if args.min_components < 1 or args.max_components < args.min_components:
+        parser.error('--min-components must be at least 1 and no more than --max-components')
+    return args
+
+
+# --------------------------------------------------
+def load_vocabulary(SI_file, prefix_file, exponents_file, max_exponent=None, dict_only=False):
+    """
+    Units, prefixes and exponents to build codes from, in file order so the same
+    seed picks the same symbols. Only symbols the grammar has a terminal for are kept.
+    All conventional terminals are kept unless dict_only, in_dict holds the symbols
+    with an SI dict entry so codes using the others can be told apart
+    """
+    SI_symbols = [row['UCUM_symbol'] for row in nc_name.read_csv_dicts(SI_file)]
+    prefixes = [row['symbol'] for row in nc_name.read_csv_dicts(prefix_file)
+                if row['symbol'] in nc_name.PREFIX_SYMBOLS]
+    powers = [int(row['power']) for row in nc_name.read_csv_dicts(exponents_file)]
+    if max_exponent is None:
+        max_exponent = max(powers)
+
+    unit_symbols = set(nc_name.METRIC_SYMBOLS + nc_name.NON_PRE_METRIC_SYMBOLS)
+    in_dict = set(SI_symbols)
+    return {
+        'units': [u for u in SI_symbols if u in unit_symbols],
+        'prefixable': [u for u in SI_symbols if u in nc_name.METRIC_SYMBOLS],
+        'prefixes': prefixes,
+        'conventional': [u for u in nc_name.CONVENTIONAL_SYMBOLS + nc_name.CONVENTIONAL_BRACKETS_SYMBOLS +
+                         nc_name.CONVENTIONAL_MIXED_BRACKETS_SYMBOLS if u in in_dict or not dict_only],
+        'brackets': nc_name.CONVENTIONAL_BRACKETS_SYMBOLS,
+        'exponents': list(range(1, max_exponent + 1)),
+        'in_dict': in_dict,
+    }
+
+
+# --------------------------------------------------
+def random_component(rng, vocab, conventional_rate):
+    """A (symbol, exponent) component, exponent is never 0"""
+    if vocab['conventional'] and rng.random() < conventional_rate:
+        symbol = rng.choice(vocab['conventional'])
+    elif vocab['prefixes'] and rng.random() < 0.5:
+        symbol = rng.choice(vocab['prefixes']) + rng.choice(vocab['prefixable'])
+    else:
+        symbol = rng.choice(vocab['units'])
+    exponent = rng.choice(vocab['exponents']) if rng.random() < 0.5 else 1
+    if rng.random() < 0.4:
+        exponent = -exponent
+    return symbol, exponent
+
+
+# --------------------------------------------------
+def render_code(components, slash):
+    """
+    Write components as a UCUM code, with "." and signed exponents e.g. kg.m-1.s-2 or with
+    "/" before each negative component e.g. kg/m/s2 (a leading "/" if none is positive)
+    """
+    if not slash:
+        return '.'.join(symbol if exponent == 1 else symbol + str(exponent) for symbol, exponent in components)
+    numerator = [symbol if exponent == 1 else symbol + str(exponent) for symbol, exponent in components if exponent > 0]
+    denominator = [symbol if exponent == -1 else symbol + str(-exponent) for symbol, exponent in components
+                   if exponent < 0]
+    return '.'.join(numerator) + ''.join('/' + d for d in denominator)
+
+
+# --------------------------------------------------
+def break_code(rng, code, components, vocab, kind):
+    """Make a valid code invalid in the way named by kind, one of invalid_kinds"""
+    if kind == 'unknown_unit':
+        # None of the grammar terminals are made of only these letters
+        unknown = ''.join(rng.choice('qjxQJX') for _ in range(rng.randint(2, 4)))
+        return '.'.join([unknown] + code.split('.')[1:]) if '.' in code else unknown
+    if kind == 'numeric_factor':
+        return '{}.{}'.format(rng.choice([10, 100, 1000, rng.randint(2, 9999)]), code)
+    if kind == 'empty_component':
+        return code + '..' + render_code(components[:1], False)
+    if kind == 'trailing_operator':
+        return code + rng.choice(['.', '/'])
+    if kind == 'prefixed_conventional':
+        return rng.choice(vocab['prefixes']) + rng.choice(vocab['brackets'])
+    if kind == 'unbalanced_bracket':
+        return rng.choice(vocab['brackets'])[:-1] + ('.' + code if rng.random() < 0.5 else '')
+    # dangling_sign
+    return code + '-'
+
+
+# --------------------------------------------------
+def generate_codes(size, seed, vocab, min_components=1, max_components=4, conventional_rate=0.1,
+                   slash_rate=0.3, invalid_rate=0.1):
+    """Yield size (code, label) pairs, label is valid, valid:no_dict_entry or invalid:<kind>"""
+    rng = random.Random(seed)
+    no_dict_entry = set(vocab['conventional']) - vocab['in_dict']
+    for _ in range(size):
+        components = [random_component(rng, vocab, conventional_rate)
+                      for _ in range(rng.randint(min_components, max_components))]
+        code = render_code(components, rng.random() < slash_rate)
+        if rng.random() < invalid_rate:
+            kind = rng.choice(invalid_kinds)
+            yield break_code(rng, code, components, vocab, kind), 'invalid:' + kind
+        elif any(symbol in no_dict_entry for symbol, _ in components):
+            yield code, 'valid:no_dict_entry'
+        else:
+            yield code, 'valid'
+
+
+# --------------------------------------------------
+def main():
+    """Write the corpus"""
+    args = get_args()
+    vocab = load_vocabulary(args.SI, args.prefix, args.exponents, args.max_exponent, args.dict_only)
+
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with nc_name.atomic_output(args.output, encoding='utf-8') as f:
+        writer = csv.writer(f)
+        for code, label in generate_codes(args.size, args.seed, vocab, args.min_components, args.max_components,
+                                          args.conventional_rate, args.slash_rate, args.invalid_rate):
+            writer.writerow([code, label] if args.labels else [code])
+    print(f'Wrote {args.size} codes to {args.output}')
+
+
+# --------------------------------------------------
+if __name__ == '__main__':
+    main()
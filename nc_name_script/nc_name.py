@@ -19,18 +19,62 @@ Test
 UCUM list from QUDT OM UO OBOE and NERC
 ./nc_name.py -d data/production/working_pooled_unit_codes.csv -o output/production/working_output.ttl -s input_mappings/input_dicts/input_ucum_dict.csv -p input_mappings/input_dicts/prefixes.csv -e input_mappings/input_dicts/exponents.csv -u1 input_mappings/UCUM/om_ucum_mapping.csv -u2 input_mappings/UCUM/qudt_ucum_mapping.csv -u3 input_mappings/UCUM/uo_ucum_mapping.csv -u4 input_mappings/UCUM/oboe_ucum_mapping.csv -u5 input_mappings/UCUM/nerc_p06_ucum_mapping.csv
 
+Same with the LALR parser (parser tables cached in .cache/ after the first run),
+add -j 4 to spread the conversion over 4 worker processes, -g lalr-inline builds the
+unit components while parsing instead of building a parse tree first
+./nc_name.py -g lalr -d data/production/working_pooled_unit_codes.csv -o output/production/working_output.ttl -s input_mappings/input_dicts/input_ucum_dict.csv -p input_mappings/input_dicts/prefixes.csv -e input_mappings/input_dicts/exponents.csv -u1 input_mappings/UCUM/om_ucum_mapping.csv -u2 input_mappings/UCUM/qudt_ucum_mapping.csv -u3 input_mappings/UCUM/uo_ucum_mapping.csv -u4 input_mappings/UCUM/oboe_ucum_mapping.csv -u5 input_mappings/UCUM/nerc_p06_ucum_mapping.csv
+
+Service mode, keeps the grammar and mappings loaded and answers batched requests
+with the same fields written to the ttl (see service_response()), the dict and mapping
+options default to the files shipped in input_mappings/, conversion messages go to STDERR:
+echo '{"codes": ["m/s", "kg.m-3"]}' | ./nc_name.py -g lalr --serve stdio
+./nc_name.py -g lalr --serve http --port 8000
+curl -d '{"codes": ["m/s", "kg.m-3"]}' localhost:8000/convert
+
+N-Triples output in 4 shards written in parallel by 4 worker processes,
+output/production/working_output-00000-of-00004.nt to working_output-00003-of-00004.nt
+./nc_name.py -t nt --shards 4 -j 4 -d data/production/working_pooled_unit_codes.csv -o output/production/working_output.nt -s input_mappings/input_dicts/input_ucum_dict.csv -p input_mappings/input_dicts/prefixes.csv -e input_mappings/input_dicts/exponents.csv -u1 input_mappings/UCUM/om_ucum_mapping.csv -u2 input_mappings/UCUM/qudt_ucum_mapping.csv -u3 input_mappings/UCUM/uo_ucum_mapping.csv -u4 input_mappings/UCUM/oboe_ucum_mapping.csv -u5 input_mappings/UCUM/nerc_p06_ucum_mapping.csv
+
+Add --profile to any run to print the time spent in each conversion stage with
+percentiles and the slowest codes, --profile-json output/production/profile.json keeps it
+
+Limits are off unless given, e.g. add --max-components 16 --max-length 128 --timeout 2 to reject
+rather than convert codes with more components or characters, or that take longer to convert,
+and --reject-report output/production/rejected.csv to list them with the reason
+
+Add --diagnostics output/production/diagnostics.jsonl to keep a json line per code that
+could not be converted, e.g. {"code": "m.qq", "stage": "parse", "error": "UnexpectedCharacters",
+"line": 1, "column": 3, "position": 2, ...}
+
+Incremental regeneration, add -m output/production/working_output.manifest.json to the
+production run above so later runs only re-convert codes that are new or whose mapping rows changed
+
 """
 
 import argparse
+import collections
+import contextlib
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
 import sys
-#sys.setrecursionlimit(10000) #if flatten causes memory issue from recursion
 import csv
-import collections.abc
 import re
-from lark import Lark, Tree, Transformer
-from itertools import permutations
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from lark import Lark, Transformer, Tree
+from lark.exceptions import UnexpectedCharacters, UnexpectedEOF, UnexpectedInput, UnexpectedToken
 from urllib import parse
 
+# VocabRegistry and ResultCache are shared with the other scripts, see shared/unit_tools.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'shared'))
+from unit_tools import ResultCache, VocabRegistry, file_digest
+
 prefix_dict_list = [
     {'prefix': 'rdf:', 'namespace': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'},
     {'prefix': 'rdfs:', 'namespace': 'http://www.w3.org/2000/01/rdf-schema#'},
@@ -68,7 +112,7 @@ def get_args():
         help='SI unit labels and codes mapping csv',
         metavar='str',
         type=str,
-        default='')
+        default=default_SI_file)
 
     parser.add_argument(
         '-p',
@@ -76,7 +120,7 @@ def get_args():
         help='SI prefixes labels and codes mapping csv',
         metavar='str',
         type=str,
-        default='')
+        default=default_prefix_file)
 
     parser.add_argument(
         '-e',
@@ -84,7 +128,7 @@ def get_args():
         help='Exponent labels csv',
         metavar='str',
         type=str,
-        default='')
+        default=default_exponents_file)
 
     parser.add_argument(
         '-o',
@@ -100,7 +144,7 @@ def get_args():
         help='UCUM mapping keys',
         metavar='str',
         type=str,
-        default='')
+        default=default_ucum_files[0])
 
     parser.add_argument(
         '-u2',
@@ -108,7 +152,7 @@ def get_args():
         help='UCUM mapping keys',
         metavar='str',
         type=str,
-        default='')
+        default=default_ucum_files[1])
 
     parser.add_argument(
         '-u3',
@@ -116,7 +160,7 @@ def get_args():
         help='UCUM mapping keys',
         metavar='str',
         type=str,
-        default='')
+        default=default_ucum_files[2])
 
     parser.add_argument(
         '-u4',
@@ -124,7 +168,7 @@ def get_args():
         help='UCUM mapping keys',
         metavar='str',
         type=str,
-        default='')
+        default=default_ucum_files[3])
 
     parser.add_argument(
         '-u5',
@@ -132,153 +176,232 @@ def get_args():
         help='UCUM mapping keys',
         metavar='str',
         type=str,
-        default='')
-
-    # parser.add_argument(
-    #     '-f', '--flag', help='A boolean flag', action='store_true')
-
-    return parser.parse_args()
-
-
-# --------------------------------------------------
-def warn(msg):
-    """Print a message to STDERR"""
-    print(msg, file=sys.stderr)
+        default=default_ucum_files[4])
 
+    parser.add_argument(
+        '-g',
+        '--parser',
+        help='Lark parser for the SI grammar, lalr is faster and cached in .cache/, '
+             'lalr-inline also skips building parse trees',
+        metavar='str',
+        type=str,
+        choices=['earley', 'lalr', 'lalr-inline'],
+        default='earley')
 
-# --------------------------------------------------
-def die(msg='Something bad happened'):
-    """warn() and exit with error"""
-    warn(msg)
-    sys.exit(1)
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        help='Number of worker processes to convert the input with',
+        metavar='int',
+        type=int,
+        default=1)
 
+    parser.add_argument(
+        '--serve',
+        help='Run as a conversion service instead of converting --input, stdio reads JSON requests '
+             'one per line from STDIN, http listens on localhost --port',
+        metavar='str',
+        type=str,
+        choices=['stdio', 'http'],
+        default=None)
 
-# Crude Transformer based on examples
-# https://lark-parser.readthedocs.io/en/latest/visitors.html#transformer
-class transformer(Transformer):
-    def SIGN(self, args):
-        return args[0]
+    parser.add_argument(
+        '-m',
+        '--manifest',
+        help='Manifest json for incremental runs, only codes that are new or whose input files '
+             'or mapping rows changed are re-converted, the rest are reused from the existing --output',
+        metavar='str',
+        type=str,
+        default='')
 
-    def DIGIT(self, args):
-        return args[0]
+    parser.add_argument(
+        '--port',
+        help='Port for --serve http',
+        metavar='int',
+        type=int,
+        default=8000)
 
-    def digits(self, args):
-        return "".join(args)
+    parser.add_argument(
+        '--no-cache',
+        help='Convert every code instead of reusing records cached in .cache/ by earlier runs',
+        action='store_true')
 
-    def factor(self, args):
-        return args[0]
+    parser.add_argument(
+        '-t',
+        '--format',
+        help='Output format, nt (N-Triples) and nq (N-Quads) write one triple per line with '
+             'no header so shards can simply be concatenated or bulk loaded',
+        metavar='str',
+        type=str,
+        choices=['ttl', 'nt', 'nq'],
+        default='ttl')
 
-    def exponent(self, args):
-        if len(args) == 1:
-            return {
-                "exponent": int(args[0]),
-            }
-        if len(args) == 2:
-            return {
-                "exponent": int("".join(args)),
-            }
+    parser.add_argument(
+        '--graph',
+        help='Graph IRI of the quads written with --format nq',
+        metavar='str',
+        type=str,
+        default='https://w3id.org/units/')
 
-    def start(self, args):
-        return args
+    parser.add_argument(
+        '--shards',
+        help='Split the nt or nq output into this many shard files named after --output, '
+             'each converted and written by its own worker process (see --jobs)',
+        metavar='int',
+        type=int,
+        default=1)
 
-    def term(self, args):
-        if len(args) == 1:
-            return args[0]
-        elif len(args) == 3:
-            return [args[0], {**args[1], **args[2]}]
+    parser.add_argument(
+        '--max-components',
+        help='Reject codes with more components than this without converting them, 0 for no limit',
+        metavar='int',
+        type=int,
+        default=0)
 
-    def component(self, args):
-        return args[0]
+    parser.add_argument(
+        '--max-length',
+        help='Reject codes longer than this many characters without converting them, 0 for no limit',
+        metavar='int',
+        type=int,
+        default=0)
 
-    def simple_unit(self, args):
-        if len(args) == 1:
-            return args[0]
-        elif len(args) == 2:
-            return {**args[0], **args[1]}
+    parser.add_argument(
+        '--timeout',
+        help='Reject codes that take longer than this many seconds to convert, 0 for no limit',
+        metavar='float',
+        type=float,
+        default=0)
 
-    def annotatable(self, args):
-        if len(args) == 1:
-            return args[0]
-        elif len(args) == 2:
-            return {**args[0], **args[1]}
+    parser.add_argument(
+        '--reject-report',
+        help='csv file listing each code rejected by --max-components, --max-length or --timeout with the reason',
+        metavar='str',
+        type=str,
+        default='')
 
-    # def annotation(self, args):
-    #     return args[0]
+    parser.add_argument(
+        '--diagnostics',
+        help='jsonl file with one line per code that could not be converted giving the code, the stage, '
+             'the error class and for parse errors the position the parser stopped at',
+        metavar='str',
+        type=str,
+        default='')
 
-    def OPERATOR(self, args):
-        return {
-            "operator": args[0],
-        }
+    parser.add_argument(
+        '--profile',
+        help='Time each conversion stage per input code and print a summary at the end, '
+             'converts in this process without the result cache so every code is measured',
+        action='store_true')
 
-    def PREFIX(self, args):
-        if args == 'da':
-            return {
-                "prefix": args[0:2],
-            }
-        else:
-            return {
-                "prefix": args[0],
-            }
+    parser.add_argument(
+        '--profile-top',
+        help='Number of slowest codes listed by --profile',
+        metavar='int',
+        type=int,
+        default=10)
 
-    def METRIC(self, args):
-        #print(args[:])
-        return {
-          "type": "metric",
-          "unit": args[:],
-        }
+    parser.add_argument(
+        '--profile-json',
+        help='Also write the --profile summary to this json file',
+        metavar='str',
+        type=str,
+        default='')
 
-    def NON_PRE_METRIC(self, args):
-        #print(args[:])
-        return {
-          "type": "metric",
-          "unit": args[:],
-        }
+    # parser.add_argument(
+    #     '-f', '--flag', help='A boolean flag', action='store_true')
 
-    def CONVENTIONAL(self, args):
-        #print(args[:])
-        return {
-          "type": "conventional",
-          "unit": args[:],
-        }
+    return parser.parse_args()
 
-    def CONVENTIONAL_BRACKETS(self, args):
-        #print(args[:])
-        return {
-          "type": "conventional",
-          "unit": args[:],
-        }
 
-    def CONVENTIONAL_MIXED_BRACKETS(self, args):
-        #print(args[:])
-        return {
-          "type": "conventional",
-          "unit": args[:],
-        }
+# --------------------------------------------------
+def warn(msg):
+    """Print a message to STDERR"""
+    print(msg, file=sys.stderr)
 
-    def EXCEPTION(self, args):
-        #print(args[:])
-        return {
-          "prefix": "d",
-          "type": "metric",
-          "unit": 'ar',
-        }
 
-    # def ANNOTATION(self, args):
-    #     return {
-    #       "type": "non-unit",
-    #       "unit": "".join(args)
-    #     }
+# --------------------------------------------------
+def die(msg='Something bad happened'):
+    """warn() and exit with error"""
+    warn(msg)
+    sys.exit(1)
 
 
-# SI grammar based on "Exhibit 1" https://ucum.org/ucum.html
-si_grammar = Lark('''
+# SI grammar terminal symbols based on "Exhibit 1" https://ucum.org/ucum.html
+# Note the symbols need to be in order if we have "m" | "mol" then mol won't be found
+# removed conventional UCUM codes:  "10*" | "10^" | "[m/s2/Hz^(1/2)]" #TODO as as grammar
+PREFIX_SYMBOLS = [
+    'Y', 'Z', 'E', 'P', 'T', 'G', 'M', 'k', 'h', 'da', 'd', 'c', 'm', 'u', 'n', 'p', 'f', 'a', 'z', 'y'
+]
+METRIC_SYMBOLS = [
+    'ar', 'A', 'Bq', 'B', 'cd', 'C', 'eV', 'F', 'Gy', 'g', 'Hz', 'H', 'J', 'kat', 'K', 'lm', 'lx', 'L',
+    'mol', 'm', 'Np', 'N', 'Ohm', 'Pa', 'rad', 'Sv', 'sr', 's', 'S', 'T', 't', 'u', 'V', 'Wb', 'W',
+    "''"
+]
+NON_PRE_METRIC_SYMBOLS = ['AU', 'Cel', 'deg', 'd', 'h', 'min', "'"]
+CONVENTIONAL_SYMBOLS = [
+    '%', 'a_g', 'a_j', 'a_t', 'Ao', 'atm', 'att', 'a', 'bar', 'Bd', 'Bi', 'bit_s', 'bit', 'By', 'b',
+    'cal_IT', 'cal_m', 'cal_th', 'cal', 'Ci', 'circ', 'dyn', 'eq', 'erg', 'g%', 'Gal', 'Gb', 'gf',
+    'gon', 'G', 'Ky', 'Lmb', 'mho', 'mo_g', 'mo_j', 'mo_s', 'mo', 'Mx', 'Oe', 'osm', 'pc', 'ph', 'P',
+    'RAD', 'REM', 'R', 'sb', 'sph', 'St', 'st', 'tex', 'U', 'wk'
+]
+CONVENTIONAL_BRACKETS_SYMBOLS = [
+    '[acr_br]', '[acr_us]', "[Amb'a'1'U]", "[anti'Xa'U]", "[APL'U]", "[arb'U]", '[AU]', '[BAU]',
+    '[bbl_us]', "[bdsk'U]", "[beth'U]", '[bf_i]', '[Btu_39]', '[Btu_59]', '[Btu_60]', '[Btu_IT]',
+    '[Btu_m]', '[Btu_th]', '[Btu]', '[bu_br]', '[bu_us]', '[c]', '[Cal]', '[car_Au]', '[car_m]',
+    '[CCID_50]', '[cft_i]', '[CFU]', '[ch_br]', '[ch_us]', '[Ch]', '[cicero]', '[cin_i]', '[cml_i]',
+    '[cr_i]', '[crd_us]', '[cup_m]', '[cup_us]', '[cyd_i]', "[D'ag'U]", '[degF]', '[degR]', '[degRe]',
+    '[den]', '[didot]', '[diop]', '[dpt_us]', '[dqt_us]', '[dr_ap]', '[dr_av]', '[drp]', "[dye'U]",
+    '[e]', '[EID_50]', '[ELU]', '[eps_0]', '[EU]', '[fdr_br]', '[fdr_us]', '[FEU]', '[FFU]',
+    '[foz_br]', '[foz_m]', '[foz_us]', '[ft_br]', '[ft_i]', '[ft_us]', '[fth_br]', '[fth_i]',
+    '[fth_us]', '[fur_us]', '[G]', '[g]', '[gal_br]', '[gal_us]', '[gal_wi]', '[gil_br]', '[gil_us]',
+    "[GPL'U]", '[gr]', '[h]', '[hd_i]', "[hnsf'U]", '[hp_C]', '[hp_M]', '[hp_Q]', '[hp_X]', "[hp'_C]",
+    "[hp'_M]", "[hp'_Q]", "[hp'_X]", '[HP]', '[HPF]', '[in_br]', "[in_i'H2O]", "[in_i'Hg]", '[in_i]',
+    '[in_us]', '[IR]', '[IU]', '[iU]', '[k]', "[ka'U]", '[kn_br]', '[kn_i]', "[knk'U]", '[kp_C]',
+    '[kp_M]', '[kp_Q]', '[kp_X]', '[lb_ap]', '[lb_av]', '[lb_tr]', '[lbf_av]', '[lcwt_av]', '[Lf]',
+    '[ligne]', '[lk_br]', '[lk_us]', '[lne]', '[LPF]', '[lton_av]', '[ly]', '[m_e]', '[m_p]',
+    "[mclg'U]", '[mesh_i]', '[MET]', '[mi_br]', '[mi_i]', '[mi_us]', '[mil_i]', '[mil_us]', '[min_br]',
+    '[min_us]', "[MPL'U]", '[mu_0]', '[nmi_br]', '[nmi_i]', '[oz_ap]', '[oz_av]', '[oz_m]', '[oz_tr]',
+    "[p'diop]", '[pc_br]', '[pca_pr]', '[pca]', '[PFU]', '[pH]', '[pi]', '[pied]', '[pk_br]',
+    '[pk_us]', '[pnt_pr]', '[pnt]', '[PNU]', '[pouce]', '[ppb]', '[ppm]', '[ppth]', '[pptr]', '[PRU]',
+    '[psi]', '[pt_br]', '[pt_us]', '[pwt_tr]', '[qt_br]', '[qt_us]', '[rch_us]', '[rd_br]', '[rd_us]',
+    '[rlk_us]', '[S]', '[sc_ap]', '[sct]', '[scwt_av]', '[sft_i]', '[sin_i]', "[smgy'U]", '[smi_us]',
+    '[smoot]', '[srd_us]', '[ston_av]', '[stone_av]', '[syd_i]', "[tb'U]", '[tbs_m]', '[tbs_us]',
+    '[TCID_50]', "[todd'U]", '[tsp_m]', '[tsp_us]', '[twp]', "[USP'U]", "[wood'U]", '[yd_br]',
+    '[yd_i]', '[yd_us]'
+]
+CONVENTIONAL_MIXED_BRACKETS_SYMBOLS = [
+    '%[slope]', 'B[10.nV]', 'B[kW]', 'B[mV]', 'B[SPL]', 'B[uV]', 'B[V]', 'B[W]', 'cal_[15]',
+    'cal_[20]', 'm[H2O]', 'm[Hg]'
+]
+EXCEPTION_SYMBOLS = ['dar']
+
+# Symbols that can also be split into a prefix and another unit symbol, with the
+# (prefix, unit, type) reading to use. A prefix only goes in front of a METRIC unit
+# so a whole symbol wins over a prefix + NON_PRE_METRIC or CONVENTIONAL split.
+# get_symbol_table() refuses to build if an overlap is missing here, so adding a
+# symbol never leaves its reading to the order of the grammar terminals
+SYMBOL_PREFERENCES = {
+    'cd': ('', 'cd', 'metric'),  # candela, not centi-day
+    'Gb': ('', 'Gb', 'conventional'),  # gilbert, not giga-barn
+    'Pa': ('', 'Pa', 'metric'),  # pascal, not peta-year
+    'ph': ('', 'ph', 'conventional'),  # phot, not pico-hour
+    'dar': ('d', 'ar', 'metric'),  # EXCEPTION, deciare rather than deca-r
+}
+
+# Prefix labels shortened in front of a unit, per label language
+# e.g. hectare and decare rather than hectoare and decaare
+PREFIX_LABEL_ELISIONS = {
+    ('h', 'ar'): {'label_en': 'hect'},
+    ('da', 'ar'): {'label_en': 'dec'},
+}
+
+si_grammar_rules = r'''
 SIGN: "-"
 DIGIT: "0" | "1" | "2" | "3" | "4" | "5" | "6" | "7" | "8" | "9"
 digits: DIGIT digits | DIGIT
 factor: digits
 exponent: SIGN digits | digits
-simple_unit: METRIC
-            | PREFIX? METRIC
+simple_unit: PREFIX? METRIC
             | NON_PRE_METRIC
             | CONVENTIONAL
             | CONVENTIONAL_BRACKETS
@@ -290,164 +413,388 @@ component: annotatable
          | factor
 term: term OPERATOR component
     | component
-start: "/" term | term
+start: "/" term -> reciprocal
+     | term
 OPERATOR: /\.|\//
-PREFIX: "Y" | "Z" | "E" | "P"| "T" | "G" | "M" | "k" | "h" | "da" | "d" | "c" | "m" | "u" | "n" | "p" | "f" | "a" | "z" | "y"
-METRIC: "ar" | "A"| "Bq" | "B" | "cd" | "C" |  "eV" | "F" | "Gy" | "g" | "Hz" | "H" | "J"| "kat" | "K" | "lm" | "lx" | "L" | "mol" |  "m" | "Np" | "N" | "Ohm" | "Pa" | "rad" | "Sv" | "sr" | "s" | "S" | "T" | "t"| "u" | "V" | "Wb" | "W" | "''" 
-NON_PRE_METRIC: "AU" | "Cel" | "deg" | "d" | "h" | "min" | "'" 
-CONVENTIONAL: "%" | "a_g" | "a_j" | "a_t" | "Ao" | "atm" | "att" | "a" | "bar" | "Bd" | "Bi" | "bit_s" | "bit" | "By" | "b" | "cal_IT" | "cal_m" | "cal_th" | "cal" | "Ci" | "circ" | "dyn" | "eq" | "erg" | "g%" | "Gal" | "Gb" | "gf" | "gon" | "G" | "Ky" | "Lmb" |  "mho" | "mo_g" | "mo_j" | "mo_s" | "mo" | "Mx" | "Oe" | "osm" | "pc" | "ph" | "P" | "RAD" | "REM" | "R" | "sb" | "sph" | "St" | "st" | "tex" | "U" | "wk"
-CONVENTIONAL_BRACKETS: "[acr_br]" | "[acr_us]" | "[Amb'a'1'U]" | "[anti'Xa'U]" | "[APL'U]" | "[arb'U]" | "[AU]" | "[BAU]" | "[bbl_us]" | "[bdsk'U]" | "[beth'U]" | "[bf_i]" | "[Btu_39]" | "[Btu_59]" | "[Btu_60]" | "[Btu_IT]" | "[Btu_m]" | "[Btu_th]" | "[Btu]" | "[bu_br]" | "[bu_us]" | "[c]" | "[Cal]" | "[car_Au]" | "[car_m]" | "[CCID_50]" | "[cft_i]" | "[CFU]" | "[ch_br]" | "[ch_us]" | "[Ch]" | "[cicero]" | "[cin_i]" | "[cml_i]" | "[cr_i]" | "[crd_us]" | "[cup_m]" | "[cup_us]" | "[cyd_i]" | "[D'ag'U]" | "[degF]" | "[degR]" | "[degRe]" | "[den]" | "[didot]" | "[diop]" | "[dpt_us]" | "[dqt_us]" | "[dr_ap]" | "[dr_av]" | "[drp]" | "[dye'U]" | "[e]" | "[EID_50]" | "[ELU]" | "[eps_0]" | "[EU]" | "[fdr_br]" | "[fdr_us]" | "[FEU]" | "[FFU]" | "[foz_br]" | "[foz_m]" | "[foz_us]" | "[ft_br]" | "[ft_i]" | "[ft_us]" | "[fth_br]" | "[fth_i]" | "[fth_us]" | "[fur_us]" | "[G]" | "[g]" | "[gal_br]" | "[gal_us]" | "[gal_wi]" | "[gil_br]" | "[gil_us]" | "[GPL'U]" | "[gr]" | "[h]" | "[hd_i]" | "[hnsf'U]" | "[hp_C]" | "[hp_M]" | "[hp_Q]" | "[hp_X]" | "[hp'_C]" | "[hp'_M]" | "[hp'_Q]" | "[hp'_X]" | "[HP]" | "[HPF]" | "[in_br]" | "[in_i'H2O]" | "[in_i'Hg]" | "[in_i]" | "[in_us]" | "[IR]" | "[IU]" | "[iU]" | "[k]" | "[ka'U]" | "[kn_br]" | "[kn_i]" | "[knk'U]" | "[kp_C]" | "[kp_M]" | "[kp_Q]" | "[kp_X]" | "[lb_ap]" | "[lb_av]" | "[lb_tr]" | "[lbf_av]" | "[lcwt_av]" | "[Lf]" | "[ligne]" | "[lk_br]" | "[lk_us]" | "[lne]" | "[LPF]" | "[lton_av]" | "[ly]" | "[m_e]" | "[m_p]" |  "[mclg'U]" | "[mesh_i]" | "[MET]" | "[mi_br]" | "[mi_i]" | "[mi_us]" | "[mil_i]" | "[mil_us]" | "[min_br]" | "[min_us]" | "[MPL'U]" | "[mu_0]" | "[nmi_br]" | "[nmi_i]" | "[oz_ap]" | "[oz_av]" | "[oz_m]" | "[oz_tr]" | "[p'diop]" | "[pc_br]" | "[pca_pr]" | "[pca]" | "[PFU]" | "[pH]" | "[pi]" | "[pied]" | "[pk_br]" | "[pk_us]" | "[pnt_pr]" | "[pnt]" | "[PNU]" | "[pouce]" | "[ppb]" | "[ppm]" | "[ppth]" | "[pptr]" | "[PRU]" | "[psi]" | "[pt_br]" | "[pt_us]" | "[pwt_tr]" | "[qt_br]" | "[qt_us]" | "[rch_us]" | "[rd_br]" | "[rd_us]" | "[rlk_us]" | "[S]" | "[sc_ap]" | "[sct]" | "[scwt_av]" | "[sft_i]" | "[sin_i]" | "[smgy'U]" | "[smi_us]" | "[smoot]" | "[srd_us]" | "[ston_av]" | "[stone_av]" | "[syd_i]" | "[tb'U]" | "[tbs_m]" | "[tbs_us]" | "[TCID_50]" | "[todd'U]" | "[tsp_m]" | "[tsp_us]" | "[twp]" | "[USP'U]" | "[wood'U]" | "[yd_br]" | "[yd_i]" | "[yd_us]"
-CONVENTIONAL_MIXED_BRACKETS: "%[slope]" | "B[10.nV]" | "B[kW]" | "B[mV]" | "B[SPL]" | "B[uV]" | "B[V]" | "B[W]" | "cal_[15]" | "cal_[20]" | "m[H2O]" | "m[Hg]" 
-EXCEPTION: "dar"
 %ignore " "           // Disregard spaces in text
-''')
-# Note the rules need to be in order if we have  "m" | "mol" then mol won't be found
-# removed conventional UCUM codes:  "10*" | "10^" | "[m/s2/Hz^(1/2)]" #TODO as as grammar
+'''
+
+# A unit symbol ends at an exponent, an operator or the end of the input
+unit_boundary = r'$|[-.\/0-9 ]'
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Where the LALR parser cache is written, see get_si_grammar()
+cache_dir = os.path.join(script_dir, '.cache')
+
+si_grammars = {}
+
 
 # --------------------------------------------------
-def flatten(x):
+def literal_terminal(name, symbols):
     """
-    https://stackoverflow.com/questions/42102473/parsing-values-from-a-list-of-dictionaries-with-nested-list-in-python
+    Lark terminal matching any of the symbols e.g., 'SIGN: "+" | "-"'
     """
-    if isinstance(x, dict):
-        return [x]
-    elif isinstance(x, collections.abc.Iterable):
-        return [a for i in x for a in flatten(i)]
-    else:
-        return [x]
+    return '{}: {}'.format(name, ' | '.join(f'"{s}"' for s in symbols))
 
 
 # --------------------------------------------------
-def get_key(val, dict):
-    for key, value in dict.items():
-        if val == value:
-            return key
-    return "key doesn't exist"
+def lookahead_terminal(name, symbols, follow, priority=1):
+    """
+    Lark regex terminal matching any of the symbols only when followed by the
+    follow pattern. The LALR lexer takes the first alternative that matches rather
+    than backtracking like Earley, so each symbol has to say what may come after it
+    """
+    alternatives = '|'.join(re.escape(s) for s in symbols)
+    return '{}.{}: /(?:{})(?={})/'.format(name, priority, alternatives, follow)
 
 
 # --------------------------------------------------
-def get_value(key, dict):
-    for k, value in dict.items():
-        if k == key:
-            return value
-    return None
+def earley_grammar_text():
+    """
+    SI grammar for the default Earley parser
+    """
+    terminals = [literal_terminal('PREFIX', PREFIX_SYMBOLS),
+                 literal_terminal('METRIC', METRIC_SYMBOLS),
+                 literal_terminal('NON_PRE_METRIC', NON_PRE_METRIC_SYMBOLS),
+                 literal_terminal('CONVENTIONAL', CONVENTIONAL_SYMBOLS),
+                 literal_terminal('CONVENTIONAL_BRACKETS', CONVENTIONAL_BRACKETS_SYMBOLS),
+                 literal_terminal('CONVENTIONAL_MIXED_BRACKETS', CONVENTIONAL_MIXED_BRACKETS_SYMBOLS),
+                 literal_terminal('EXCEPTION', EXCEPTION_SYMBOLS)]
+    return si_grammar_rules + '\n'.join(terminals) + '\n'
 
 
 # --------------------------------------------------
-def pre_process_unit_list(result, original, dict_list):
+def lalr_grammar_text():
     """
-    Removes operators "." or "/" to get this back `'operator': '.',`
-    Deals with start = "/" special case
-    Writes out all terms with prefixes (empty string if none exist)
-    Write out all terms with exponents (including 1 if none exist)
+    SI grammar for the LALR parser producing the same trees as the Earley grammar.
+    Unit symbols only match up to a unit boundary and prefixes only match when a
+    prefixable METRIC symbol follows, so the lexer never has to backtrack
+    e.g., 'mol' is never lexed as 'mo' + 'l' and 'h' is a prefix in 'hPa' but hour in 'h.m-1'
+    Priorities settle the remaining overlaps: a prefix wins over the same symbol as a
+    unit and 'dar' is lexed as EXCEPTION as the Earley parser does
     """
-    # Get prefix if existing:
-    if "prefix" in result:
-        prefix = result['prefix']
-    else:
-        prefix = ''
+    metric = ' *(?:{})(?:{})'.format('|'.join(re.escape(s) for s in METRIC_SYMBOLS), unit_boundary)
+    terminals = [lookahead_terminal('PREFIX', PREFIX_SYMBOLS, metric, priority=2),
+                 lookahead_terminal('METRIC', METRIC_SYMBOLS, unit_boundary),
+                 lookahead_terminal('NON_PRE_METRIC', NON_PRE_METRIC_SYMBOLS, unit_boundary),
+                 lookahead_terminal('CONVENTIONAL', CONVENTIONAL_SYMBOLS, unit_boundary),
+                 lookahead_terminal('CONVENTIONAL_BRACKETS', CONVENTIONAL_BRACKETS_SYMBOLS, unit_boundary),
+                 lookahead_terminal('CONVENTIONAL_MIXED_BRACKETS', CONVENTIONAL_MIXED_BRACKETS_SYMBOLS, unit_boundary),
+                 lookahead_terminal('EXCEPTION', EXCEPTION_SYMBOLS, unit_boundary, priority=3)]
+    return si_grammar_rules + '\n'.join(terminals) + '\n'
 
-    if get_value(key="operator", dict=result) == "/":
-        # if it doesn't have an exponent key create one at -1 else change exp to -
-        if "exponent" not in result:
-            x = {'prefix': prefix, 'type': result['type'], 'unit': result['unit'], 'exponent': int('-1')}
-            dict_list.append(x)
-        else:
-            exp = int('-' + str(result['exponent']))
-            x = {'prefix': prefix, 'type': result['type'], 'unit': result['unit'], 'exponent': exp}
-            dict_list.append(x)
-    # no operator or . case
-    else:
-        # Get or create exponent
-        if "exponent" in result and original[0] == '/':
-            exponent = int('-' + str(result['exponent']))
-        elif "exponent" in result:
-            exponent = result['exponent']
-        elif original[0] == '/':
-            exponent = -1
+
+# --------------------------------------------------
+def get_si_grammar(parser='earley'):
+    """
+    Build the SI grammar parser once per process.
+    The LALR parser is serialized to .cache/ so later runs skip grammar analysis,
+    Lark rebuilds the cache itself whenever the grammar text or options change
+    """
+    if parser not in si_grammars:
+        if parser == 'earley':
+            si_grammars[parser] = Lark(earley_grammar_text())
+        elif parser == 'lalr':
+            os.makedirs(cache_dir, exist_ok=True)
+            si_grammars[parser] = Lark(lalr_grammar_text(), parser='lalr', lexer='contextual',
+                                       cache=os.path.join(cache_dir, 'si_grammar_lalr.cache'))
+        elif parser == 'lalr-inline':
+            # Lark runs the transformer callbacks as the LALR parser reduces each rule so
+            # parse() returns the UnitComponent list without building a Tree, keep_all_tokens
+            # passes the SIGN and DIGIT tokens of exponents to the callbacks
+            os.makedirs(cache_dir, exist_ok=True)
+            si_grammars[parser] = Lark(lalr_grammar_text(), parser='lalr', lexer='contextual',
+                                       transformer=component_transformer(), keep_all_tokens=True,
+                                       cache=os.path.join(cache_dir, 'si_grammar_lalr_inline.cache'))
         else:
-            exponent = 1
-        x = {'prefix': prefix, 'type': result['type'], 'unit': result['unit'], 'exponent': exponent}
-        dict_list.append(x)
+            raise ValueError(f"Unknown parser '{parser}'")
+    return si_grammars[parser]
+
+
+# Range of exponents precomputed in the component table, anything else goes to the grammar
+component_table_max_exponent = 9
 
-    return dict_list
+component_tables = {}
 
 
 # --------------------------------------------------
-def gen_symbol_code(result, mapping_dict, code_str):
+def get_symbol_table():
     """
-    Add code_str based on prefix and unit
+    Map every unit symbol the SI grammar accepts, PREFIX x METRIC, the unprefixed unit
+    terminals and EXCEPTION, to its one (prefix, unit, type) reading. Symbols that also
+    read as a prefix in front of a non prefixable unit, e.g. cd as c + d, take their
+    reading from SYMBOL_PREFERENCES. Built once per process
     """
-    unit = get_value(result['unit'], mapping_dict)
-    try:
-        code = result['prefix'] + unit
-        result.update({code_str: code})
-    except:
-        print(f"No SI code for '{result}'")
+    if 'symbols' not in component_tables:
+        unprefixed = [(unit, 'metric') for unit in METRIC_SYMBOLS + NON_PRE_METRIC_SYMBOLS] + \
+                     [(unit, 'conventional') for unit in
+                      CONVENTIONAL_SYMBOLS + CONVENTIONAL_BRACKETS_SYMBOLS + CONVENTIONAL_MIXED_BRACKETS_SYMBOLS]
+        readings = {}
+        for unit, unit_type in unprefixed:
+            readings.setdefault(unit, set()).add(('', unit, unit_type))
+        for unit in METRIC_SYMBOLS:
+            for prefix in PREFIX_SYMBOLS:
+                readings.setdefault(prefix + unit, set()).add((prefix, unit, 'metric'))
+        for unit in EXCEPTION_SYMBOLS:
+            readings.setdefault(unit, set()).add(SYMBOL_PREFERENCES[unit])
+        # Splits the grammar doesn't allow, only here to find the symbols they overlap
+        for unit, unit_type in unprefixed:
+            for prefix in PREFIX_SYMBOLS:
+                if prefix + unit in readings:
+                    readings[prefix + unit].add((prefix, unit, unit_type))
+
+        table = {}
+        for symbol, parts in readings.items():
+            if symbol in SYMBOL_PREFERENCES:
+                table[symbol] = SYMBOL_PREFERENCES[symbol]
+            elif len(parts) == 1:
+                table[symbol] = next(iter(parts))
+            else:
+                raise ValueError(f"'{symbol}' can be read as {sorted(parts)}, add it to SYMBOL_PREFERENCES")
+        component_tables['symbols'] = table
+    return component_tables['symbols']
 
 
 # --------------------------------------------------
-def gen_si_ucum_list(dict_list):
+def get_component_table():
     """
-    Create permutations of possible UCUM strings for input unit list
-    E.g., 'm.s-1' -> ['m.s-1', 's-1.m']
-    https://www.geeksforgeeks.org/generate-all-the-permutation-of-a-list-in-python/
-    At the moment only handels the ucum "." cases not the "/" cases
-    TODO add the / UCUM cases
+    Precompute every single component from get_symbol_table() with no exponent or an
+    exponent from -9 to 9, mapping the component string to its (prefix, unit, type, exponent)
+    so the common components are read with one dict lookup. No symbol ends in a digit
+    so each string has one reading. Built once per process
     """
-    return_list = []
-    code_exp_list = []
-    for d in dict_list:
-        if d['exponent'] == 1:
-            exp = ''
+    if 'components' not in component_tables:
+        exponents = [('', 1)]
+        for exponent in range(-component_table_max_exponent, component_table_max_exponent + 1):
+            exponents.append((str(exponent), exponent))
+
+        component_tables['components'] = {symbol + exponent_str: (prefix, unit, unit_type, exponent)
+                                          for symbol, (prefix, unit, unit_type) in get_symbol_table().items()
+                                          for exponent_str, exponent in exponents}
+    return component_tables['components']
+
+
+# --------------------------------------------------
+def lookup_components(code, table):
+    """
+    Tokenize a code without the grammar, split it on operators outside of brackets and
+    look each part up in the component table, or for larger exponents split off the
+    exponent and look the whole symbol up, so a part is read in one longest match step
+    and symbols like cd or dar always get their SYMBOL_PREFERENCES reading
+    Returns the UnitComponent list, or None if any part can't be read so the caller can
+    fall back to the grammar e.g., for numeric factors, spaces or to report a parse error
+    """
+    # The grammar ignores spaces, a code with any space has a part that isn't in the table
+    # and goes to the grammar, so here a leading "/" is always the first character
+    invert = code[:1] == '/'
+    start = 1 if invert else 0
+    operator = None
+    depth = 0
+    component_list = []
+    for i in range(start, len(code) + 1):
+        c = code[i] if i < len(code) else None
+        if c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+        elif c is None or (depth == 0 and (c == '.' or c == '/')):
+            part = code[start:i]
+            entry = table.get(part)
+            if entry is not None:
+                prefix, unit, unit_type, exponent = entry
+            else:
+                match = ucum_component_regex.match(part)
+                if match is None or match.group(2) is None or match.group(1) not in table:
+                    return None
+                prefix, unit, unit_type, _ = table[match.group(1)]
+                exponent = int(match.group(2))
+            if operator == '/' or invert:
+                exponent = -exponent
+            component_list.append(UnitComponent(prefix, unit, unit_type, exponent))
+            operator = c
+            start = i + 1
+    return component_list
+
+
+# Simple UCUM component: symbol followed by an optional signed exponent e.g., 'km-2'
+ucum_component_regex = re.compile(r"^(.*[^0-9-])(-?[0-9]+)?$")
+
+
+# --------------------------------------------------
+class UnitComponent:
+    """
+    One prefix + unit + exponent part of an input code along with the codes and labels
+    generated for it. Slotted since the pipeline makes one for every part of every input
+    """
+    __slots__ = ('prefix', 'unit', 'type', 'exponent', 'ucum_code', 'si_code', 'label_en', 'sort_key')
+
+    def __init__(self, prefix, unit, type, exponent):
+        self.prefix = prefix
+        self.unit = unit
+        self.type = type
+        self.exponent = exponent
+        self.ucum_code = prefix + unit
+        self.si_code = None
+        self.label_en = None
+        # Canonical order, case folded UCUM code first as in canonical_ucum_key() then
+        # exact code, exponent and prefix so ties e.g. `m-2` and `m-1` always sort the same way
+        self.sort_key = (self.ucum_code.casefold(), self.ucum_code, exponent, prefix)
+
+    def __repr__(self):
+        return (f"UnitComponent(prefix='{self.prefix}', unit='{self.unit}', type='{self.type}', "
+                f"exponent={self.exponent})")
+
+
+# Component type of each unit terminal in the SI grammar
+unit_terminal_types = {
+    'METRIC': 'metric',
+    'NON_PRE_METRIC': 'metric',
+    'CONVENTIONAL': 'conventional',
+    'CONVENTIONAL_BRACKETS': 'conventional',
+    'CONVENTIONAL_MIXED_BRACKETS': 'conventional',
+}
+
+
+# --------------------------------------------------
+def compile_component(component, operator, invert):
+    """
+    Build the UnitComponent for a `component` subtree from its tokens in input order
+    A "/" operator or a leading "/" on the whole code makes the exponent negative
+    Raises ValueError for numeric factors e.g., `10.m` which have no unit
+    """
+    prefix = ''
+    unit = None
+    unit_type = None
+    exponent = ''
+    stack = [component]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Tree):
+            if node.data == 'factor':
+                raise ValueError('numeric factors are not supported')
+            stack.extend(reversed(node.children))
+        elif node.type == 'PREFIX':
+            prefix = str(node)
+        elif node.type == 'EXCEPTION':
+            prefix, unit, unit_type = SYMBOL_PREFERENCES[str(node)]
+        elif node.type in unit_terminal_types:
+            unit, unit_type = str(node), unit_terminal_types[node.type]
         else:
-            exp = str(d['exponent'])
-        x = d['ucum_code'] + exp
-        code_exp_list.append(x)
-    code_exp_list = list(permutations(code_exp_list))
-
-    for p in code_exp_list:
-        ucum_str_list = []
-        for i in p:
-            ucum_str_list.append(i)
-        outstr = '.'.join(ucum_str_list)
-        return_list.append(outstr)
-    return return_list
+            # SIGN and DIGIT tokens of the exponent
+            exponent += node
+    exponent = int(exponent) if exponent else 1
+    if operator == '/' or invert:
+        exponent = -exponent
+    return UnitComponent(prefix, unit, unit_type, exponent)
 
 
 # --------------------------------------------------
-def gen_label_parts(result, SI_unit_label_dict, prefix_dict, exponents_dict, label_lan):
+def compile_components(tree, original):
     """
-    Create labels from units and prefixes
-    TODO add special case for unit = are to print hectare instead of hectoare etc
-    Have a temporary workaround for hectare and decare but open question if are should
-    be crossable with all prefixes see https://github.com/kaiiam/UO_revamp/issues/6
+    Compile a parsed SI grammar tree into a flat list of UnitComponent without recursion
+    `term: term OPERATOR component` is left recursive so walk down the left spine
+    collecting (operator, component) pairs, then read them back in input order
     """
+    # A leading "/", even after spaces, parses as reciprocal rather than start
+    invert = tree.data == 'reciprocal'
+    node = tree.children[0]
+    pairs = []
+    while len(node.children) == 3:
+        pairs.append((str(node.children[1]), node.children[2]))
+        node = node.children[0]
+    pairs.append((None, node.children[0]))
+    pairs.reverse()
+    return [compile_component(component, operator, invert) for operator, component in pairs]
 
-    unit = get_value(result['unit'], SI_unit_label_dict)
 
-    if get_value(result['prefix'], prefix_dict) is not None:
-        prefix = get_value(result['prefix'], prefix_dict)
-    else:
+# --------------------------------------------------
+class component_transformer(Transformer):
+    """
+    Rule callbacks for the lalr-inline parser, builds the same UnitComponent list as
+    compile_components() while parsing. term is left recursive so LALR reduces it once
+    per component and each reduction appends to the one list
+    """
+
+    def digits(self, args):
+        return ''.join(args)
+
+    def exponent(self, args):
+        return int(''.join(args))
+
+    def factor(self, args):
+        raise ValueError('numeric factors are not supported')
+
+    def simple_unit(self, args):
+        token = args[-1]
+        if token.type == 'EXCEPTION':
+            return SYMBOL_PREFERENCES[str(token)]
+        prefix = str(args[0]) if len(args) == 2 else ''
+        return prefix, str(token), unit_terminal_types[token.type]
+
+    def annotatable(self, args):
+        prefix, unit, unit_type = args[0]
+        exponent = args[1] if len(args) == 2 else 1
+        return prefix, unit, unit_type, exponent
+
+    def component(self, args):
+        return args[0]
+
+    def term(self, args):
+        if len(args) == 1:
+            return [(None, args[0])]
+        args[0].append((str(args[1]), args[2]))
+        return args[0]
+
+    def start(self, args, invert=False):
+        component_list = []
+        for operator, (prefix, unit, unit_type, exponent) in args[-1]:
+            if operator == '/' or invert:
+                exponent = -exponent
+            component_list.append(UnitComponent(prefix, unit, unit_type, exponent))
+        return component_list
+
+    def reciprocal(self, args):
+        # A leading "/" makes every component a denominator
+        return self.start(args, invert=True)
+
+
+# --------------------------------------------------
+def gen_symbol_code(result, vocab, table, code_str):
+    """
+    Set code_str on the component based on prefix and the unit symbol from the vocab table
+    """
+    unit = vocab.value(table, result.unit)
+    if unit is None:
+        raise LookupError(f"No SI code for '{result}'")
+    setattr(result, code_str, result.prefix + unit)
+
+
+# --------------------------------------------------
+def gen_label_parts(result, vocab, label_lan):
+    """
+    Create labels from units and prefixes, shortening prefixes in PREFIX_LABEL_ELISIONS
+    e.g. hectare and decare. Open question if are should be crossable with all prefixes
+    see https://github.com/kaiiam/UO_revamp/issues/6
+    """
+
+    unit = vocab.value(f'unit_{label_lan}', result.unit)
+
+    prefix = vocab.value(f'prefix_{label_lan}', result.prefix)
+    if prefix is None:
         prefix = ''
 
-    if unit == 'are':
-        prefix = get_value(result['prefix'], prefix_dict)
-        if prefix == None:
-            prefix = ''
-        if prefix == 'hecto':
-            prefix = 'hect'
-        if prefix == 'deca':
-            prefix = 'dec'
-
-    power = str(result['exponent'])
-    power = power.replace('-', '')
-    power = get_value(power, exponents_dict)
+    elision = PREFIX_LABEL_ELISIONS.get((result.prefix, result.unit))
+    if elision is not None:
+        prefix = elision.get(label_lan, prefix)
+
+    power = str(abs(result.exponent))
+    power = vocab.value(f'exponent_{label_lan}', power)
     if power is None:
         label_str = prefix + unit
     else:
         label_str = power + ' ' + prefix + unit
-    result.update({label_lan: label_str})
+    setattr(result, label_lan, label_str)
 
 
 # --------------------------------------------------
@@ -455,8 +802,8 @@ def split_num_denom(result, numerator_list, denominator_list):
     """
     Separate input list into numerator and denominator lists
     """
-    # split based on result['exponent']
-    if str(result['exponent'])[0] == "-":
+    # split based on result.exponent
+    if result.exponent < 0:
         denominator_list.append(result)
     else:
         numerator_list.append(result)
@@ -468,38 +815,37 @@ def canonical_nc_label(numerator_list, denominator_list, label_lan):
     # Case 1 no denominators
     if not denominator_list:
         for n in numerator_list:
-            return_lst.append(n[label_lan])
+            return_lst.append(getattr(n, label_lan))
     # case 2 no numerators
     elif not numerator_list:
         return_lst.append('reciprocal')
         for d in denominator_list:
-            return_lst.append(d[label_lan])
+            return_lst.append(getattr(d, label_lan))
     # Case 3 mix of numerators and denominators
     else:
         for n in numerator_list:
-            return_lst.append(n[label_lan])
+            return_lst.append(getattr(n, label_lan))
         return_lst.append('per')
         for d in denominator_list:
-            return_lst.append(d[label_lan])
+            return_lst.append(getattr(d, label_lan))
     return ' '.join(return_lst)
 
 
 # --------------------------------------------------
-def retrieve_exponent(in_arg, exponents_en_dict):
-    power = str(in_arg['exponent'])
-    power = power.replace('-', '')
-    power = get_value(power, exponents_en_dict)
+def retrieve_exponent(in_arg, vocab, label_lan):
+    power = str(abs(in_arg.exponent))
+    power = vocab.value(f'exponent_{label_lan}', power)
     return power
 
 
 # --------------------------------------------------
-def canonical_en_definition_helper(units_list, unit_label_en_dict, exponents_en_dict, prefix_numbers_dict):
+def canonical_en_definition_helper(units_list, vocab, label_lan):
     return_lst = []
     for u in units_list:
-        unit = get_value(u['unit'], unit_label_en_dict)
-        power = retrieve_exponent(u, exponents_en_dict)
-        if get_value(key=u['prefix'], dict=prefix_numbers_dict) is not None:
-            prefix_num = get_value(key=u['prefix'], dict=prefix_numbers_dict)
+        unit = vocab.value(f'unit_{label_lan}', u.unit)
+        power = retrieve_exponent(u, vocab, label_lan)
+        prefix_num = vocab.value('prefix_num', u.prefix)
+        if prefix_num is not None:
             prefix_val = f'10{prefix_num}'
         else:
             prefix_val = '1'
@@ -511,50 +857,41 @@ def canonical_en_definition_helper(units_list, unit_label_en_dict, exponents_en_
 
 
 # --------------------------------------------------
-def canonical_en_definition(numerator_list, denominator_list, unit_def_dict, prefix_numbers_dict, ucum_unit_label_en_dict, exponents_en_dict, label_lan):
+def canonical_en_definition(numerator_list, denominator_list, vocab, label_lan):
     definition = None
     # Case 1 no denominators, and only a SI base unit with no exponent
-    if not denominator_list and len(numerator_list) == 1 and numerator_list[0]['exponent'] == 1:
+    if not denominator_list and len(numerator_list) == 1 and numerator_list[0].exponent == 1:
         # Without prefix:
-        if numerator_list[0]['prefix'] == '':
+        if numerator_list[0].prefix == '':
             for n in numerator_list:
-                definition = get_value(key=n['unit'], dict=unit_def_dict)
+                definition = vocab.value('unit_definition_en', n.unit)
         # special case for kg
-        elif numerator_list[0]['prefix'] == 'k' and numerator_list[0]['unit'] == 'g':
+        elif numerator_list[0].prefix == 'k' and numerator_list[0].unit == 'g':
             kilogram_def_en = 'An SI base unit which 1) is the SI unit of mass and 2) is defined by taking the fixed numerical value of the Planck constant, h, to be 6.626 070 15 × 10⁻³⁴ when expressed in the unit joule second, which is equal to kilogram square metre per second, where the metre and the second are defined in terms of c and ∆νCs.'
             definition = kilogram_def_en
         # Regular With prefix case
-        elif numerator_list[0]['prefix'] != '':
+        elif numerator_list[0].prefix != '':
             for n in numerator_list:
-                si_label = get_value(key=n['unit'], dict=ucum_unit_label_en_dict)
-                prefix_num = get_value(key=n['prefix'], dict=prefix_numbers_dict)
+                si_label = vocab.value(f'unit_{label_lan}', n.unit)
+                prefix_num = vocab.value('prefix_num', n.prefix)
                 definition = f'A unit which is equal to 10{prefix_num} {si_label}.'
     # Case 2 no denominators
     elif not denominator_list:
-        return_lst = canonical_en_definition_helper(units_list=numerator_list, unit_label_en_dict=ucum_unit_label_en_dict,
-                                                    exponents_en_dict=exponents_en_dict,
-                                                    prefix_numbers_dict=prefix_numbers_dict)
+        return_lst = canonical_en_definition_helper(units_list=numerator_list, vocab=vocab, label_lan=label_lan)
         def_start = 'A unit which is equal to '
         definition_mid = ' by '.join(return_lst)
         definition = def_start + definition_mid + '.'
     # Case 3 no numerators
     elif not numerator_list:
-        return_lst = canonical_en_definition_helper(units_list=denominator_list, unit_label_en_dict=ucum_unit_label_en_dict,
-                                                    exponents_en_dict=exponents_en_dict,
-                                                    prefix_numbers_dict=prefix_numbers_dict)
+        return_lst = canonical_en_definition_helper(units_list=denominator_list, vocab=vocab, label_lan=label_lan)
         def_start = 'A unit which is equal to the reciprocal of '
         definition_mid = ' by '.join(return_lst)
         definition = def_start + definition_mid + '.'
     # Case 4 mix of numerators and denominators
     else:
-        num_list = canonical_en_definition_helper(units_list=numerator_list, unit_label_en_dict=ucum_unit_label_en_dict,
-                                                    exponents_en_dict=exponents_en_dict,
-                                                    prefix_numbers_dict=prefix_numbers_dict)
-
-        denom_list = canonical_en_definition_helper(units_list=denominator_list,
-                                                    unit_label_en_dict=ucum_unit_label_en_dict,
-                                                    exponents_en_dict=exponents_en_dict,
-                                                    prefix_numbers_dict=prefix_numbers_dict)
+        num_list = canonical_en_definition_helper(units_list=numerator_list, vocab=vocab, label_lan=label_lan)
+
+        denom_list = canonical_en_definition_helper(units_list=denominator_list, vocab=vocab, label_lan=label_lan)
         def_start = 'A unit which is equal to '
         def_num = ' by '.join(num_list)
         def_denom = ' by '.join(denom_list)
@@ -571,16 +908,16 @@ def canonical_si_code(numerator_list, denominator_list):
     # print(f'{str}\N{SUPERSCRIPT MINUS}\N{SUPERSCRIPT SEVEN}')
     return_lst = []
     for n in numerator_list:
-        if 'si_code' in n:
-            if str(n['exponent']) == '1':
-                return_lst.append(n['si_code'])
+        if n.si_code is not None:
+            if str(n.exponent) == '1':
+                return_lst.append(n.si_code)
             else:
-                return_lst.append(n['si_code'] + str(n['exponent']))
+                return_lst.append(n.si_code + str(n.exponent))
         else:
             return None
     for n in denominator_list:
-        if 'si_code' in n:
-            return_lst.append(n['si_code'] + str(n['exponent']))
+        if n.si_code is not None:
+            return_lst.append(n.si_code + str(n.exponent))
     return ' '.join(return_lst)
 
 
@@ -588,99 +925,164 @@ def canonical_si_code(numerator_list, denominator_list):
 def canonical_ucum_code(numerator_list, denominator_list):
     return_lst = []
     for n in numerator_list:
-        if str(n['exponent']) == '1':
-            return_lst.append(n['ucum_code'])
+        if str(n.exponent) == '1':
+            return_lst.append(n.ucum_code)
         else:
-            return_lst.append(n['ucum_code'] + str(n['exponent']))
+            return_lst.append(n.ucum_code + str(n.exponent))
     for n in denominator_list:
-        return_lst.append(n['ucum_code'] + str(n['exponent']))
+        return_lst.append(n.ucum_code + str(n.exponent))
     return '.'.join(return_lst)
 
 
 # --------------------------------------------------
-def lookahead(iterable):
-    """Pass through all values from the given iterable, augmented by the
-    information if there are more values to come after the current one
-    (True), or if it is the last value (False).
-    https://stackoverflow.com/questions/1630320/what-is-the-pythonic-way-to-detect-the-last-element-in-a-for-loop
+def split_ucum_str(ucum_str):
     """
-    # Get an iterator and pull the first value.
-    it = iter(iterable)
-    last = next(it)
-    # Run the iterator to exhaustion (starting from the second value).
-    for val in it:
-        # Report the *previous* value (more to come).
-        try:
-            yield last, True
-            last = val
-        except StopIteration:
-            return
-    # Report the last value.
-    try:
-        yield last, False
-    except StopIteration:
-        return
+    Split a UCUM string into (symbol, exponent) pairs the same way compile_components
+    folds operators into exponents e.g., 'm/s2' -> [('m', 1), ('s', -2)]
+    A leading "/" makes every component a denominator
+    Operators inside brackets e.g., 'B[10.nV]' are part of the symbol
+    Returns None if the string isn't made up of simple components
+    """
+    if not ucum_str or any(c in ucum_str for c in '(){}*^ '):
+        return None
+    invert = ucum_str[0] == '/'
+    if invert:
+        ucum_str = ucum_str[1:]
+
+    # Split on operators outside of brackets keeping track of the operator
+    parts = []
+    operator = '.'
+    depth = 0
+    start = 0
+    for i, c in enumerate(ucum_str):
+        if c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+        elif c in './' and depth == 0:
+            parts.append((operator, ucum_str[start:i]))
+            operator = c
+            start = i + 1
+    parts.append((operator, ucum_str[start:]))
+
+    return_list = []
+    for operator, part in parts:
+        if not part:
+            return None
+        # Numeric factors e.g., '1000' are kept whole
+        if part.isdigit():
+            symbol, exponent = part, 1
+        else:
+            match = ucum_component_regex.match(part)
+            if not match:
+                return None
+            symbol = match.group(1)
+            exponent = int(match.group(2)) if match.group(2) else 1
+        if invert or operator == '/':
+            exponent = -exponent
+        return_list.append((symbol, exponent))
+    return return_list
 
 
 # --------------------------------------------------
-def temp_ucum_map(ucum_list, ontology_mapping_list):
+def canonical_ucum_key(ucum_str):
     """
-    Temporary lookup to UCUM to ontology mappings. Later version will use the phase 2
-    UCUM parser to parse the UCUM mappings (first column at least) and convert those to
-    canonical UCUM string via our function to do so, then look those up based on input
+    Canonical form of any UCUM string matching canonical_ucum_code()
+    numerators then denominators each sorted alphabetically joined by "."
+    E.g., 'm/s', 's-1.m' and 'm.s-1' -> 'm.s-1'
+    Returns None if the string can't be split into components
     """
-    return_list = []
-    for u in ucum_list:
-        for x in ontology_mapping_list:
-            if u == x['UCUM1'] or u == x['UCUM2'] or u == x['UCUM3'] or u == x['UCUM4']:
-                return_list.append(x['IRI'])
-    return return_list
+    components = split_ucum_str(ucum_str)
+    if components is None:
+        return None
+    components.sort(key=lambda c: (c[0].casefold(), c[0], c[1]))
+    return_lst = []
+    for symbol, exponent in components:
+        if exponent >= 0:
+            return_lst.append(symbol if exponent == 1 else symbol + str(exponent))
+    for symbol, exponent in components:
+        if exponent < 0:
+            return_lst.append(symbol + str(exponent))
+    return '.'.join(return_lst)
+
+
+# --------------------------------------------------
+def build_mapping_index(ontology_mapping_list):
+    """
+    Index the ontology to UCUM mappings once at load time by canonical UCUM key
+    so any component order or "/" form used in the mapping files is found with a
+    single lookup of the canonical code of the input.
+    Returns a dict of canonical UCUM key -> list of IRIs using it (in mapping file order)
+    """
+    mapping_index = {}
+    for x in ontology_mapping_list:
+        # A row only counts once per key even if it lists several forms of it
+        key_set = set()
+        for u in [x.get('UCUM1'), x.get('UCUM2'), x.get('UCUM3'), x.get('UCUM4')]:
+            key = canonical_ucum_key(u)
+            if key is not None:
+                key_set.add(key)
+        for key in key_set:
+            mapping_index.setdefault(key, []).append(x['IRI'])
+    return mapping_index
+
+
+# --------------------------------------------------
+def temp_ucum_map(ucum_code, mapping_index):
+    """
+    Lookup UCUM to ontology mappings for a canonical UCUM code
+    """
+    return list(mapping_index.get(canonical_ucum_key(ucum_code), []))
+
+
+# Namespace of each prefix, to write full IRIs in N-Triples
+prefix_namespaces = {p['prefix']: p['namespace'] for p in prefix_dict_list}
+
+# Ontologies linked with skos:exactMatch, in the order they are written out
+exact_match_prefixes = ['QUDT:', 'OM:', 'UO:', 'OBOE:', 'NERC_P06:']
+
+# One anchored alternation over the exactMatch namespaces, longest first so a
+# namespace nested in another always wins, compiled once for all IRIs
+curie_namespaces = {p['namespace']: p['prefix'] for p in prefix_dict_list if p['prefix'] in exact_match_prefixes}
+curie_regex = re.compile('({})(.*)'.format('|'.join(
+    re.escape(namespace) for namespace in sorted(curie_namespaces, key=len, reverse=True))))
 
 
 # --------------------------------------------------
-def format_si_ttl(iri, label, si_code, ucum_code, definition_en, mapping_list):
-    qudt_regex = r"(http://qudt.org/vocab/unit/)(.*)"
-    om_regex = r"(http://www.ontology-of-units-of-measure.org/resource/om-2/)(.*)"
-    uo_regex = r"(http://purl.obolibrary.org/obo/UO_)(.*)"
-    oboe_regex = r"(http://ecoinformatics.org/oboe/oboe.1.2/oboe-standards.owl#)(.*)"
-    nerc_regex = r"(http://vocab.nerc.ac.uk/collection/P06/current/)(.*)(/)"
+def compact_iri(iri):
+    """
+    Compact an IRI into a CURIE with its longest matching exactMatch namespace,
+    e.g. http://vocab.nerc.ac.uk/collection/P06/current/UPCT/ -> NERC_P06:UPCT
+    Returns None for IRIs outside those namespaces
+    """
+    match = curie_regex.match(iri)
+    if match is None:
+        return None
+    local_name = match.group(2)
+    # NERC concept IRIs end with "/" which can't end a CURIE
+    if local_name.endswith('/'):
+        local_name = local_name[:-1]
+    return curie_namespaces[match.group(1)] + local_name
 
-    qudt_list = []
-    om_list = []
-    uo_list = []
-    oboe_list = []
-    nerc_list = []
 
+# --------------------------------------------------
+def exact_match_curies(mapping_list):
+    """
+    Compact the mapped ontology IRIs into CURIEs, grouped in QUDT, OM, UO, OBOE, NERC order
+    """
+    grouped = {prefix: [] for prefix in exact_match_prefixes}
     for m in mapping_list:
-        if re.search(qudt_regex, m):
-            match = re.search(qudt_regex, m)
-            qudt_id = match.group(2)
-            qudt_id = 'QUDT:' + qudt_id
-            qudt_list.append(qudt_id)
-        if re.search(om_regex, m):
-            match = re.search(om_regex, m)
-            om_id = match.group(2)
-            om_id = 'OM:' + om_id
-            om_list.append(om_id)
-        if re.search(uo_regex, m):
-            match = re.search(uo_regex, m)
-            uo_id = match.group(2)
-            uo_id = 'UO:' + uo_id
-            uo_list.append(uo_id)
-        if re.search(oboe_regex, m):
-            match = re.search(oboe_regex, m)
-            oboe_id = match.group(2)
-            oboe_id = 'OBOE:' + oboe_id
-            oboe_list.append(oboe_id)
-        if re.search(nerc_regex, m):
-            match = re.search(nerc_regex, m)
-            nerc_id = match.group(2)
-            nerc_id = 'NERC_P06:' + nerc_id
-            nerc_list.append(nerc_id)
-
-    iri = '{}{}\n'.format('unit:', parse.quote(iri))
-    return_str = ''
-    return_str += iri
+        curie = compact_iri(m)
+        if curie is not None:
+            grouped[curie[:curie.index(':') + 1]].append(curie)
+    return [curie for prefix in exact_match_prefixes for curie in grouped[prefix]]
+
+
+# --------------------------------------------------
+def format_si_ttl(iri, label, si_code, ucum_code, definition_en, exact_match, ucum_aliases=()):
+    """
+    Format the ttl block of a unit, exact_match holds the CURIEs from exact_match_curies()
+    """
     return_list = []
 
     # Assert that this is an owl instance
@@ -698,154 +1100,902 @@ def format_si_ttl(iri, label, si_code, ucum_code, definition_en, mapping_list):
     if ucum_code:
         return_list.append('  {}ucum_code "{}"'.format('unit:', ucum_code))
 
-    [return_list.append('  {}exactMatch {}'.format('skos:', x)) for x in qudt_list if qudt_list]
+    return_list.extend('  {}exactMatch {}'.format('skos:', x) for x in exact_match)
 
-    [return_list.append('  {}exactMatch {}'.format('skos:', x)) for x in om_list if om_list]
+    # Other input spellings of the same unit e.g. "m/s" for m.s-1
+    return_list.extend('  {}ucum_code "{}"'.format('unit:', u) for u in ucum_aliases)
 
-    [return_list.append('  {}exactMatch {}'.format('skos:', x)) for x in uo_list if uo_list]
+    # Add ; and . for ttl formatting
+    return '{}{}\n{} .\n'.format('unit:', parse.quote(iri), ' ;\n'.join(return_list))
 
-    [return_list.append('  {}exactMatch {}'.format('skos:', x)) for x in oboe_list if oboe_list]
 
-    [return_list.append('  {}exactMatch {}'.format('skos:', x)) for x in nerc_list if nerc_list]
+# --------------------------------------------------
+def read_csv_dicts(csv_file):
+    """
+    Open and save a csv file as list of dictionaries
+    """
+    with open(csv_file, mode='r', encoding='utf-8-sig') as csvfile:
+        return list(csv.DictReader(csvfile))
 
-    # [return_list.append('  {}ucum_code "{}"'.format('unit:', u)) for u in ucum_list]
 
-    # Add ; and . for ttl formatting
-    for i, has_more in lookahead(return_list):
-        if has_more:
-            return_str += (i + ' ;\n')
-        else:
-            return_str += (i + ' .\n')
-    return return_str
+# --------------------------------------------------
+def file_stat(path):
+    """mtime and size of a file, a cheap first check for changes before hashing it"""
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
 
 
 # --------------------------------------------------
-def main():
-    """Main function to test if input is SI or UCUM then parse and covert and post"""
-    args = get_args()
-    input_file = args.input
-    SI_file = args.SI
-    prefix_file = args.prefix
-    exponents_file = args.exponents
-    out_file = args.output
-
-    # Read in argument input files
-    input_list = []
-    # open and save input data file as list of strings
-    with open(input_file, mode='r', encoding='utf-8-sig') as input:
-        csv_reader = csv.reader(input, delimiter=',')
-        for row in csv_reader:
-            input_list.append(row[0])
-
-    om_ucum = args.ucum1
-    qudt_ucum = args.ucum2
-    uo_ucum = args.ucum3
-    oboe_ucum = args.ucum4
-    nerc_ucum = args.ucum5
-
-    # Read in SI units
-    SI_list = []
-    # open and save input file as list of dictionaries
-    with open(SI_file, mode='r', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            SI_list.append(row)
-
-    ucum_si_units_dict = {}
-    for i in SI_list:
-        ucum_si_units_dict[i['UCUM_symbol']] = i['SI_symbol']
-
-    ucum_unit_label_en_dict = {}
-    for i in SI_list:
-        ucum_unit_label_en_dict[i['UCUM_symbol']] = i['label_en']
-
-    ucum_unit_def_en_dict = {}
-    for i in SI_list:
-        ucum_unit_def_en_dict[i['UCUM_symbol']] = i['definition_en']
+def vocab_snapshot_file(source_files):
+    """
+    Snapshot file in .cache/ for a set of source files, so runs with different
+    dict or mapping files each keep their own snapshot
+    """
+    key = hashlib.sha256('\n'.join(source_files).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'vocab_{}.pickle'.format(key))
 
-    # Read in SI prefixes
-    prefix_list = []
-    # open and save input file as list of dictionaries
-    with open(prefix_file, mode='r', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            prefix_list.append(row)
 
-    prefix_en_dict = {}
-    for i in prefix_list:
-        prefix_en_dict[i['symbol']] = i['label_en']
+# Keys of a vocab snapshot, see load_conversion_tables()
+snapshot_keys = {'sources', 'vocab_forward', 'vocab_reverse', 'mapping_index'}
 
-    prefix_numbers_dict = {}
-    for i in prefix_list:
-        prefix_numbers_dict[i['symbol']] = i['prefix_num']
 
-    # Read in powers
-    exponents_list = []
-    # open and save input file as list of dictionaries
-    with open(exponents_file, mode='r', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            exponents_list.append(row)
+# --------------------------------------------------
+def write_vocab_snapshot(snapshot_file, snapshot):
+    """Write the snapshot next to its final name and move it in place, so readers never see half a file"""
+    os.makedirs(os.path.dirname(snapshot_file), exist_ok=True)
+    tmp_file = '{}.{}.tmp'.format(snapshot_file, os.getpid())
+    with open(tmp_file, mode='wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, snapshot_file)
 
-    exponents_en_dict = {}
-    for i in exponents_list:
-        exponents_en_dict[i['power']] = i['label_en']
 
-    ###### Mappings #######################################
-    # Read in ontology to UCUM mappings
-    om_ucum_list = []
-    # open and save input file as list of dictionaries
-    with open(om_ucum, mode='r', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            om_ucum_list.append(row)
-
-    qudt_ucum_list = []
-    # open and save input file as list of dictionaries
-    with open(qudt_ucum, mode='r', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            qudt_ucum_list.append(row)
-
-    uo_ucum_list = []
-    # open and save input file as list of dictionaries
-    with open(uo_ucum, mode='r', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            uo_ucum_list.append(row)
-
-    oboe_ucum_list = []
-    # open and save input file as list of dictionaries
-    with open(oboe_ucum, mode='r', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            oboe_ucum_list.append(row)
-
-    nerc_ucum_list = []
-    # open and save input file as list of dictionaries
-    with open(nerc_ucum, mode='r', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            nerc_ucum_list.append(row)
-
-    # Join all the input ontology to UCUM mappings into single list of dict
-    ontology_mapping_list = om_ucum_list + qudt_ucum_list + uo_ucum_list + oboe_ucum_list + nerc_ucum_list
-
-    valid_SI_input_list = []
-
-    # # breakup input list one term at a time
-    for u in input_list:
-        try:
-            tree = si_grammar.parse(u)
-            #result = transformer().transform(tree)
-            valid_SI_input_list.append(u)
-        except:
-            print(f"Could not process '{u}' with SI parser")
+# --------------------------------------------------
+def read_vocab_snapshot(snapshot_file, source_files):
+    """
+    Return the snapshot if it was built from the current contents of source_files, else None.
+    Files whose mtime or size moved are hashed, and if only the mtime changed the
+    snapshot is kept and rewritten with the new stats
+    """
+    # A missing, truncated or outdated snapshot is rebuilt rather than failing the run
+    try:
+        with open(snapshot_file, mode='rb') as f:
+            snapshot = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    if not isinstance(snapshot, dict) or not snapshot_keys <= snapshot.keys():
+        return None
+
+    sources = snapshot['sources']
+    if not isinstance(sources, dict) or list(sources) != source_files:
+        return None
+    if not all(isinstance(entry, dict) and {'stat', 'digest'} <= entry.keys() for entry in sources.values()):
+        return None
+    touched = False
+    for path in source_files:
+        stat = file_stat(path)
+        if sources[path]['stat'] == stat:
+            continue
+        if sources[path]['digest'] != file_digest(path):
+            return None
+        sources[path]['stat'] = stat
+        touched = True
+    if touched:
+        write_vocab_snapshot(snapshot_file, snapshot)
+    return snapshot
+
+
+# --------------------------------------------------
+def build_conversion_tables(SI_file, prefix_file, exponents_file, ucum_files):
+    """
+    Read in the SI units, prefixes, exponents and ontology to UCUM mapping csv files
+    and build the vocab registry and mapping index used by convert_unit()
+    """
+    vocab = VocabRegistry()
+
+    # Read in SI units, keyed by UCUM symbol
+    SI_list = read_csv_dicts(SI_file)
+    vocab.add_table('unit_si_code', SI_list, 'UCUM_symbol', 'SI_symbol')
+    vocab.add_table('unit_label_en', SI_list, 'UCUM_symbol', 'label_en')
+    vocab.add_table('unit_definition_en', SI_list, 'UCUM_symbol', 'definition_en')
+
+    # Read in SI prefixes
+    prefix_list = read_csv_dicts(prefix_file)
+    vocab.add_table('prefix_label_en', prefix_list, 'symbol', 'label_en')
+    vocab.add_table('prefix_num', prefix_list, 'symbol', 'prefix_num')
+
+    # Read in powers
+    exponents_list = read_csv_dicts(exponents_file)
+    vocab.add_table('exponent_label_en', exponents_list, 'power', 'label_en')
+
+    ###### Mappings #######################################
+    # Join all the input ontology to UCUM mappings (OM, QUDT, UO, OBOE, NERC) into single list of dict
+    ontology_mapping_list = []
+    for ucum_file in ucum_files:
+        ontology_mapping_list += read_csv_dicts(ucum_file)
+
+    return {
+        'vocab': vocab,
+        # Index mappings by UCUM string for constant time lookups
+        'mapping_index': build_mapping_index(ontology_mapping_list),
+    }
+
+
+# --------------------------------------------------
+def load_conversion_tables(SI_file, prefix_file, exponents_file, ucum_files, snapshot=True):
+    """
+    Return the tables built by build_conversion_tables(), loaded from a pickled snapshot in
+    .cache/ when it is up to date with the csv files and this script, otherwise built from
+    the csv files and saved as the new snapshot
+    """
+    if not snapshot:
+        return build_conversion_tables(SI_file, prefix_file, exponents_file, ucum_files)
+
+    # The script is a source too, a change to how tables are built must rebuild them
+    source_files = [os.path.abspath(path) for path in
+                    [__file__, SI_file, prefix_file, exponents_file] + list(ucum_files)]
+    snapshot_file = vocab_snapshot_file(source_files)
+    cached = read_vocab_snapshot(snapshot_file, source_files)
+    if cached is not None:
+        # Plain dicts are stored rather than the registry, so the snapshot loads whether
+        # this file runs as a script or is imported as a module
+        vocab = VocabRegistry()
+        vocab.forward = cached['vocab_forward']
+        vocab.reverse = cached['vocab_reverse']
+        return {'vocab': vocab, 'mapping_index': cached['mapping_index']}
+
+    tables = build_conversion_tables(SI_file, prefix_file, exponents_file, ucum_files)
+    write_vocab_snapshot(snapshot_file, {
+        'sources': {path: {'stat': file_stat(path), 'digest': file_digest(path)} for path in source_files},
+        'vocab_forward': tables['vocab'].forward,
+        'vocab_reverse': tables['vocab'].reverse,
+        'mapping_index': tables['mapping_index'],
+    })
+    return tables
+
+
+# --------------------------------------------------
+def convert_unit(u, component_list, tables, profiler=None):
+    """
+    Generate the canonical label, definition, SI and UCUM codes and ontology mappings
+    for the components of a parsed input, returned as a record dict
+    With a StageProfiler the time of each step is charged to its stage
+    """
+    # Determine type SI vs conventional
+    # to optionally Add SI codes in next step
+    is_conventional = any(r.type == 'conventional' for r in component_list)
+
+    # Optionally Add SI codes
+    if not is_conventional:
+        for r in component_list:
+            # create the SI code from prefix and unit
+            gen_symbol_code(result=r, vocab=tables['vocab'], table='unit_si_code', code_str='si_code')
+    # print(u, component_list)
+    if profiler is not None:
+        profiler.lap('si_symbols')
+
+    # Function to create labels from units and prefixes
+    # pass in the vocab registry + desired label_lan
+    for r in component_list:
+        gen_label_parts(result=r, vocab=tables['vocab'], label_lan='label_en')
+    # print(u, component_list)
+    if profiler is not None:
+        profiler.lap('labels')
+
+    # Function to split numerator and denominator into two lists
+    numerator_list = []
+    denominator_list = []
+    for r in component_list:
+        split_num_denom(result=r, numerator_list=numerator_list, denominator_list=denominator_list)
+    # print(u, 'num:', numerator_list, 'denom:', denominator_list)
+
+    # # Sort in canonical alphabetical order on the precomputed keys
+    numerator_list.sort(key=lambda k: k.sort_key)
+    denominator_list.sort(key=lambda k: k.sort_key)
+    if profiler is not None:
+        profiler.lap('sort')
+
+    # # Generate canonical term label
+    label = canonical_nc_label(numerator_list=numerator_list, denominator_list=denominator_list, label_lan='label_en')
+    if profiler is not None:
+        profiler.lap('label')
+
+    # Generate canonical english definition
+    definition_en = canonical_en_definition(numerator_list=numerator_list, denominator_list=denominator_list,
+                                            vocab=tables['vocab'], label_lan='label_en')
+    if profiler is not None:
+        profiler.lap('definition')
+
+    # Generate canonical SI code e.g. `Pa s`
+    # First pass complete, Later can fix superscript issue with fstrings TODO
+    # print(u, '->', canonical_si_code(numerator_list=numerator_list,denominator_list=denominator_list))
+    si_code = canonical_si_code(numerator_list=numerator_list, denominator_list=denominator_list)
+
+    # Generate canonical UCUM code
+    ucum_code = canonical_ucum_code(numerator_list=numerator_list, denominator_list=denominator_list)
+    #print(ucum_code)
+    if profiler is not None:
+        profiler.lap('codes')
+
+    # Map UCUM codes to external Ontologies
+    mapping_list = temp_ucum_map(ucum_code=ucum_code, mapping_index=tables['mapping_index'])
+    #print(mapping_list)
+
+    exact_match = exact_match_curies(mapping_list)
+    if profiler is not None:
+        profiler.lap('mapping')
+
+    # We can alternatively pass ucum_code instead of si_nc_name_iri
+    # as iri to circumvent NC name mapping
+    return {
+        'input': u,
+        'iri': ucum_code,
+        'label': label,
+        'definition_en': definition_en,
+        'si_code': si_code,
+        'ucum_code': ucum_code,
+        'mapping_list': mapping_list,
+        'exact_match': exact_match,
+    }
+
+
+# --------------------------------------------------
+def format_record_ttl(record):
+    """
+    Format ttl for a record returned by convert_unit(), for aliases_only just the
+    ucum_code triples of its ucum_aliases, empty if there are none
+    """
+    if record.get('aliases_only'):
+        if not record['ucum_aliases']:
+            return ''
+        aliases = ' ;\n'.join('  {}ucum_code "{}"'.format('unit:', u) for u in record['ucum_aliases'])
+        return '{}{}\n{} .\n'.format('unit:', parse.quote(record['iri']), aliases)
+    return format_si_ttl(iri=record['iri'], label=record['label'], si_code=record['si_code'],
+                         ucum_code=record['ucum_code'], definition_en=record['definition_en'],
+                         exact_match=record['exact_match'], ucum_aliases=record.get('ucum_aliases', ()))
+
+
+# --------------------------------------------------
+def expand_curie(curie):
+    """Full IRI of a CURIE using the namespaces in prefix_dict_list"""
+    prefix, local_name = curie.split(':', 1)
+    return prefix_namespaces[prefix + ':'] + local_name
+
+
+# --------------------------------------------------
+def nt_literal(value, lang=None):
+    """N-Triples literal with quotes, backslashes and line breaks escaped"""
+    value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+    if lang:
+        return '"{}"@{}'.format(value, lang)
+    return '"{}"'.format(value)
+
+
+# --------------------------------------------------
+def record_triples(record):
+    """
+    The triples of the ttl block of a record as N-Triples terms, in the same order
+    and describing the same graph as format_record_ttl()
+    """
+    subject = '<{}>'.format(expand_curie('unit:' + parse.quote(record['iri'])))
+    ucum_predicate = '<{}>'.format(expand_curie('unit:ucum_code'))
+    if record.get('aliases_only'):
+        return [(subject, ucum_predicate, nt_literal(u)) for u in record['ucum_aliases']]
+    triples = [(subject, '<{}>'.format(expand_curie('rdf:type')), '<{}>'.format(expand_curie('owl:NamedIndividual')))]
+    if record['label']:
+        triples.append((subject, '<{}>'.format(expand_curie('rdfs:label')), nt_literal(record['label'], 'en')))
+    if record['definition_en']:
+        triples.append((subject, '<{}>'.format(expand_curie('IAO:0000115')), nt_literal(record['definition_en'], 'en')))
+    if record['si_code']:
+        triples.append((subject, '<{}>'.format(expand_curie('unit:SI_code')), nt_literal(record['si_code'])))
+    if record['ucum_code']:
+        triples.append((subject, ucum_predicate, nt_literal(record['ucum_code'])))
+    for curie in record['exact_match']:
+        triples.append((subject, '<{}>'.format(expand_curie('skos:exactMatch')), '<{}>'.format(expand_curie(curie))))
+    for u in record.get('ucum_aliases', ()):
+        triples.append((subject, ucum_predicate, nt_literal(u)))
+    return triples
+
+
+# --------------------------------------------------
+def format_record_nt(record, graph=None):
+    """
+    Format a record returned by convert_unit() as N-Triples lines, or N-Quads in graph
+    """
+    graph_term = ' <{}>'.format(graph) if graph else ''
+    return ''.join('{} {} {}{} .\n'.format(s, p, o, graph_term) for s, p, o in record_triples(record))
+
+
+# --------------------------------------------------
+def format_record_ttl_block(record):
+    """format_record_ttl() followed by the blank line separating Turtle blocks, if there is a block"""
+    text = format_record_ttl(record)
+    return text + '\n' if text else text
+
+
+# --------------------------------------------------
+def record_formatter(output_format, graph):
+    """The function formatting a record for output_format"""
+    if output_format == 'nt':
+        return format_record_nt
+    if output_format == 'nq':
+        return lambda record: format_record_nt(record, graph)
+    return format_record_ttl_block
+
+
+# Input dicts and ontology mappings shipped with the repo, used by ConversionContext
+# when no files are given
+default_SI_file = os.path.join(script_dir, 'input_mappings', 'input_dicts', 'input_ucum_dict.csv')
+default_prefix_file = os.path.join(script_dir, 'input_mappings', 'input_dicts', 'prefixes.csv')
+default_exponents_file = os.path.join(script_dir, 'input_mappings', 'input_dicts', 'exponents.csv')
+default_ucum_files = [os.path.join(script_dir, 'input_mappings', 'UCUM', f) for f in
+                      ['om_ucum_mapping.csv', 'qudt_ucum_mapping.csv', 'uo_ucum_mapping.csv',
+                       'oboe_ucum_mapping.csv', 'nerc_p06_ucum_mapping.csv']]
+
+
+# --------------------------------------------------
+class ConversionError(Exception):
+    """
+    A code that could not be converted, str() gives the error message and diagnostic
+    is a dict with the code, the stage it failed in, the exception class and for parse
+    errors the position the parser stopped at, see conversion_error(). Returned rather
+    than raised, report_error() prints it and writes the diagnostic to --diagnostics
+    """
+
+    def __init__(self, message, diagnostic):
+        super().__init__(message)
+        self.message = message
+        self.diagnostic = diagnostic
+
+    def __str__(self):
+        return self.message
+
+    def __reduce__(self):
+        return ConversionError, (self.message, self.diagnostic)
+
+
+# --------------------------------------------------
+class RejectedCode(ConversionError):
+    """
+    Error message of a code rejected by one of the --max-components, --max-length
+    or --timeout limits, keeps the code and reason for the reject report.
+    Rejects aren't cached
+    """
+
+    def __init__(self, code, reason, stage='limits'):
+        super().__init__(f"Rejected '{code}': {reason}",
+                         {'code': code, 'stage': stage, 'error': 'RejectedCode', 'detail': reason})
+        self.code = code
+        self.reason = reason
+
+    def __reduce__(self):
+        return RejectedCode, (self.code, self.reason, self.diagnostic['stage'])
+
+
+# --------------------------------------------------
+def conversion_error(code, stage, exception):
+    """
+    ConversionError for an exception raised converting code in stage, parse for the
+    grammar (or the component table fast path) and convert for convert_unit()
+    """
+    diagnostic = {'code': code, 'stage': stage, 'error': type(exception).__name__,
+                  'detail': str(exception).strip().split('\n', 1)[0]}
+    if isinstance(exception, UnexpectedInput):
+        # Unexpected end of input has no position of its own
+        position = exception.pos_in_stream if exception.pos_in_stream >= 0 else len(code)
+        diagnostic.update(line=exception.line if exception.line >= 0 else 1, column=position + 1,
+                          position=position)
+        if isinstance(exception, UnexpectedCharacters):
+            diagnostic['unexpected'] = exception.char
+            diagnostic['expected'] = sorted(set(exception.allowed or ()))
+        elif isinstance(exception, UnexpectedToken):
+            diagnostic['unexpected'] = str(exception.token)
+            diagnostic['expected'] = sorted(set(exception.expected))
+        elif isinstance(exception, UnexpectedEOF):
+            diagnostic['unexpected'] = ''
+            diagnostic['expected'] = sorted(set(exception.expected))
+
+    if stage == 'convert':
+        message = f"Could not convert '{code}'"
+    elif isinstance(exception, ValueError):
+        message = f"Ran into numeric factor when processing '{code}'"
+    else:
+        message = f"Could not process '{code}' with SI parser"
+    return ConversionError(message, diagnostic)
+
+
+# --------------------------------------------------
+class ConversionTimeout(Exception):
+    """Raised by the interval timer when converting a code takes longer than the timeout"""
+
+
+# Set by ConversionContext.convert_with_error() while the timer is running, a SIGALRM
+# delivered once a conversion has finished is ignored
+timer_state = {'converting': False}
+
+
+# --------------------------------------------------
+def raise_timeout(signum, frame):
+    """SIGALRM handler for the per code timeout"""
+    if timer_state['converting']:
+        raise ConversionTimeout()
+
+
+# --------------------------------------------------
+def count_components(code):
+    """Number of components in a code, "." and "/" inside [] don't separate components"""
+    if '[' not in code:
+        count = code.count('.') + code.count('/')
+    else:
+        count = 0
+        depth = 0
+        for c in code:
+            if c == '[':
+                depth += 1
+            elif c == ']':
+                depth -= 1
+            elif depth == 0 and c in './':
+                count += 1
+    # A leading "/" as in /s doesn't follow a component
+    return count if code.startswith('/') else count + 1
+
+
+# --------------------------------------------------
+def check_limits(code, max_components=None, max_length=None):
+    """Reason a code is over the length or component limits, None if it is within them"""
+    if max_length and len(code) > max_length:
+        return f'{len(code)} characters, over the limit of {max_length}'
+    if max_components:
+        components = count_components(code)
+        if components > max_components:
+            return f'{components} components, over the limit of {max_components}'
+    return None
+
+
+# --------------------------------------------------
+def rejected_codes(codes, limits):
+    """(None, RejectedCode) results for the codes over the component or length limits"""
+    rejected = {}
+    for u in codes:
+        reason = check_limits(u, limits.get('max_components'), limits.get('max_length'))
+        if reason is not None:
+            rejected[u] = (None, RejectedCode(u, reason))
+    return rejected
+
+
+# --------------------------------------------------
+class ConversionContext:
+    """
+    Loads the SI grammar, vocab registry and mapping index once so UCUM codes can be
+    converted from other python code without rebuilding the pipeline per call e.g.
+
+        from nc_name import ConversionContext
+        context = ConversionContext(parser='lalr')
+        record = context.convert('m/s')
+        records = context.convert_many(['m/s', 'kg.m-3'])
+
+    Records are the dicts returned by convert_unit(), None for inputs that can't be processed
+    """
+
+    def __init__(self, SI_file=default_SI_file, prefix_file=default_prefix_file,
+                 exponents_file=default_exponents_file, ucum_files=default_ucum_files, parser='earley',
+                 fast_path=True, snapshot=True, max_components=None, max_length=None, timeout=None):
+        self.si_grammar = get_si_grammar(parser=parser)
+        # lalr-inline parses straight to UnitComponents, see component_transformer
+        self.inline = parser == 'lalr-inline'
+        # Codes made of simple components skip the grammar, see lookup_components()
+        self.component_table = get_component_table() if fast_path else None
+        self.tables = load_conversion_tables(SI_file, prefix_file, exponents_file, ucum_files, snapshot=snapshot)
+        # Set to a StageProfiler to time each conversion stage
+        self.profiler = None
+
+        # Limits, codes over them are rejected with a RejectedCode error
+        self.max_components = max_components
+        self.max_length = max_length
+        # The timeout uses SIGALRM so only works in the main thread of a process
+        self.timeout = None
+        if timeout and hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread():
+            self.timeout = timeout
+            signal.signal(signal.SIGALRM, raise_timeout)
+
+    def parse_components(self, code):
+        """Parse a code into its list of UnitComponent"""
+        profiler = self.profiler
+        if self.component_table is not None:
+            component_list = lookup_components(code, self.component_table)
+            if profiler is not None:
+                profiler.lap('lookup')
+            if component_list is not None:
+                return component_list
+        if self.inline:
+            component_list = self.si_grammar.parse(code)
+            if profiler is not None:
+                profiler.lap('parse')
+            return component_list
+        tree = self.si_grammar.parse(code)
+        if profiler is not None:
+            profiler.lap('parse')
+        component_list = compile_components(tree, code)
+        if profiler is not None:
+            profiler.lap('compile')
+        return component_list
+
+    def convert_with_error(self, code):
+        """Convert a single UCUM code, returns (record, None) or (None, error message)"""
+        # One try per code, a failing code raises once and is caught here, this includes
+        # input that isn't a string
+        stage = 'limits'
+        try:
+            reason = check_limits(code, self.max_components, self.max_length)
+            if reason is not None:
+                return None, RejectedCode(code, reason)
+
+            if self.profiler is not None:
+                self.profiler.start(code)
+            stage = 'parse'
+            # The timer is armed inside the try so a timeout is always caught below
+            timer_state['converting'] = True
+            if self.timeout:
+                signal.setitimer(signal.ITIMER_REAL, self.timeout)
+            try:
+                component_list = self.parse_components(code)
+                stage = 'convert'
+                return convert_unit(code, component_list, self.tables, self.profiler), None
+            finally:
+                timer_state['converting'] = False
+                if self.timeout:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+        except ConversionTimeout:
+            error = RejectedCode(code, f'took longer than the {self.timeout}s limit', stage='timeout')
+        except Exception as e:
+            error = conversion_error(code, stage, e)
+        # Time spent on a code that failed counts as parsing it
+        if self.profiler is not None and stage != 'limits':
+            self.profiler.lap('parse')
+        return None, error
+
+    def convert(self, code):
+        """Convert a single UCUM code to a record, None if it could not be processed, errors go to STDERR"""
+        record, error = self.convert_with_error(code)
+        if error is not None:
+            warn(error)
+        return record
+
+    def convert_many(self, codes):
+        """Convert a list of UCUM codes to a list of records in the same order"""
+        return [self.convert(code) for code in codes]
+
+
+# Conversion context of this process set up by init_converter() so each worker
+# process loads the grammar and vocabulary once rather than once per input
+converter_state = {}
+
+# Bytes buffered before output files are written to disk
+output_buffer_size = 1 << 20
+
+# Input codes converted per batch, bounds memory use for long inputs while
+# keeping the worker pool and cache queries busy with enough codes per call
+input_batch_size = 2048
+
+# Input rows grouped by canonical UCUM key at a time, see input_group_windows(), bounds
+# memory for long inputs while any unit spelled several ways within a window still
+# gets a single block
+group_window_size = 1 << 16
+
+
+# --------------------------------------------------
+def init_converter(SI_file, prefix_file, exponents_file, ucum_files, parser, limits=None):
+    """
+    Set up the ConversionContext for this process, also used as the
+    worker process initializer in --jobs mode
+    limits holds the max_components, max_length and timeout ConversionContext options
+    """
+    converter_state['context'] = ConversionContext(SI_file, prefix_file, exponents_file, ucum_files, parser,
+                                                   **(limits or {}))
+    converter_state['context'].profiler = converter_state.get('profiler')
+
+
+# --------------------------------------------------
+def report_error(error):
+    """
+    Print a conversion error, write its diagnostic as a json line to --diagnostics and
+    add codes rejected by a limit to the --reject-report
+    """
+    print(error)
+    if converter_state.get('diagnostics') is not None:
+        converter_state['diagnostics'].write(json.dumps(error.diagnostic, ensure_ascii=False) + '\n')
+    if isinstance(error, RejectedCode) and converter_state.get('rejects') is not None:
+        converter_state['rejects'].writerow([error.code, error.reason])
+
+
+# --------------------------------------------------
+def convert_input(u):
+    """
+    Convert a single input code with the context set up by init_converter()
+    Returns (record, None) or (None, error message) if the input could not be processed
+    """
+    return converter_state['context'].convert_with_error(u)
+
+
+# --------------------------------------------------
+@contextlib.contextmanager
+def batch_converter(converter_args, jobs):
+    """
+    Yield a function converting a list of input codes to a list of (record, error) in
+    input order, spread over worker processes when jobs > 1. The context or worker
+    pool is only set up once there is something to convert, so fully cached runs skip it
+    """
+    with contextlib.ExitStack() as stack:
+        pool = []
+
+        def convert_batch(batch):
+            if jobs > 1:
+                if not pool:
+                    # Workers each load the grammar and tables once
+                    pool.append(stack.enter_context(multiprocessing.Pool(
+                        processes=jobs, initializer=init_converter, initargs=converter_args)))
+                chunksize = max(1, min(256, len(batch) // (jobs * 4)))
+                return pool[0].map(convert_input, batch, chunksize=chunksize)
+            if not pool:
+                init_converter(*converter_args)
+                pool.append(None)
+            return [convert_input(u) for u in batch]
+
+        yield convert_batch
+
+
+# --------------------------------------------------
+def batched(iterable, size):
+    """Yield lists of up to size items from iterable"""
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+# --------------------------------------------------
+def convert_records(codes, converter_args, jobs, cache=None, with_errors=False):
+    """
+    Yield the record (or None) for each input code in input order, printing the
+    error message of codes that could not be processed, or (record, error) with_errors
+    codes can be any iterable, it is consumed input_batch_size codes at a time so
+    only one batch is held in memory however long the input is
+    With a ResultCache only the codes missing from it are converted, the cache is
+    read and written here in the main process rather than by the --jobs workers
+    """
+    limits = converter_args[5] if len(converter_args) > 5 else {}
+    with batch_converter(converter_args, jobs) as convert_batch:
+        for batch in batched(codes, input_batch_size):
+            # Codes over the length or component limits are rejected before the cache
+            # is read, so a record cached by a run with other limits can't bring them back
+            found = rejected_codes(batch, limits)
+            if cache is not None:
+                found.update(get_cached_results(cache, [u for u in batch if u not in found]))
+            misses = [u for u in dict.fromkeys(batch) if u not in found]
+            if misses:
+                for u, result in zip(misses, convert_batch(misses)):
+                    found[u] = result
+                    # Errors are cached as well so known bad codes aren't parsed again,
+                    # except timeouts which depend on the machine and its load
+                    if cache is not None and not isinstance(result[1], RejectedCode):
+                        put_cached_result(cache, u, *result)
+                if cache is not None:
+                    cache.commit()
+
+            for u in batch:
+                record, error = found[u]
+                if error is not None:
+                    report_error(error)
+                yield (record, error) if with_errors else record
+
+
+# --------------------------------------------------
+def group_input_codes(codes):
+    """
+    Group input codes by canonical UCUM key so e.g. 'm/s', 's-1.m' and 'm.s-1' are
+    converted once. Returns a dict of key -> distinct spellings in input order, codes
+    that can't be split into components are a group of their own
+    """
+    keys = {}
+    groups = {}
+    for u in codes:
+        if u in keys:
+            continue
+        keys[u] = canonical_ucum_key(u) or u
+        groups.setdefault(keys[u], []).append(u)
+    return groups
+
+
+# --------------------------------------------------
+class ContinuedGroup(list):
+    """
+    New spellings of a unit whose block input_group_windows() already had written for
+    an earlier window, their records only add the ucum_code triples of these spellings
+    """
+
+
+# --------------------------------------------------
+def set_ucum_aliases(record, spellings):
+    """
+    Set the input spellings of a group that differ from the canonical UCUM code as the
+    ucum_aliases of its record, aliases_only if the rest of the block is already written
+    """
+    record['ucum_aliases'] = [u for u in spellings if u != record['ucum_code']]
+    record['aliases_only'] = isinstance(spellings, ContinuedGroup)
+
+
+# --------------------------------------------------
+def input_group_windows(codes, window=group_window_size):
+    """
+    Read codes window rows at a time and yield the spelling lists of group_input_codes()
+    for each window, so grouping never holds more than one window of the input. The keys
+    of the last window groups are remembered with their spellings. Spellings already
+    written are dropped and new spellings of a unit whose block was written in an earlier
+    window come as a ContinuedGroup, for which only their ucum_code triples are written.
+    A unit seen again after window more keys have gone by gets a second full block
+    """
+    seen = collections.OrderedDict()
+    for rows in batched(codes, window):
+        spelling_lists = []
+        for key, spellings in group_input_codes(rows).items():
+            written = seen.pop(key, None)
+            if written is None:
+                seen[key] = set(spellings)
+                spelling_lists.append(spellings)
+                continue
+            new_spellings = [u for u in spellings if u not in written]
+            seen[key] = written.union(new_spellings)
+            if new_spellings:
+                spelling_lists.append(ContinuedGroup(new_spellings))
+        while len(seen) > window:
+            seen.popitem(last=False)
+        yield spelling_lists
+
 
-    # Open outfile
-    f = open(out_file, mode='w', encoding='utf-8-sig')
+# --------------------------------------------------
+def convert_groups(spelling_lists, converter_args, jobs, cache=None, with_errors=False):
+    """
+    Convert the first spelling of each group from group_input_codes() and yield its record
+    (or None), with the input spellings that differ from the canonical UCUM code as ucum_aliases
+    or (record, error) with_errors. spelling_lists can be any iterable e.g. a generator
+    """
+    spelling_lists, group_spellings = itertools.tee(spelling_lists)
+    representatives = (spellings[0] for spellings in group_spellings)
+    results = convert_records(representatives, converter_args, jobs, cache, with_errors=True)
+    for spellings, (record, error) in zip(spelling_lists, results):
+        if record is not None:
+            set_ucum_aliases(record, spellings)
+        yield (record, error) if with_errors else record
+
+
+# --------------------------------------------------
+def shard_files(out_file, shards):
+    """Shard file names for out_file, e.g. out-00000-of-00004.nt to out-00003-of-00004.nt"""
+    root, ext = os.path.splitext(out_file)
+    return ['{}-{:05d}-of-{:05d}{}'.format(root, k, shards, ext) for k in range(shards)]
+
+
+# --------------------------------------------------
+def write_shard(shard_file, shard, output_format, graph):
+    """
+    Convert one shard of unit groups and append them to shard_file, run in a worker
+    process in --jobs mode with the context set up by init_converter(). shard is a list
+    of (spellings, cached (record, error) or None) for each group. Returns the error
+    messages in shard order and the (code, (record, error)) converted here so the main
+    process can cache them
+    """
+    formatter = record_formatter(output_format, graph)
+    errors = []
+    converted = []
+    with open(shard_file, mode='a', encoding='utf-8', buffering=output_buffer_size) as f:
+        for spellings, result in shard:
+            if result is None:
+                result = convert_input(spellings[0])
+                converted.append((spellings[0], result))
+            record, error = result
+            if error is not None:
+                errors.append(error)
+                continue
+            set_ucum_aliases(record, spellings)
+            f.write(formatter(record))
+    return errors, converted
+
+
+# --------------------------------------------------
+def write_shards(codes, out_file, shards, output_format, graph, converter_args, jobs, cache=None):
+    """
+    Deal the unit groups of each window of input codes from input_group_windows() round
+    robin into shards and have write_shard() convert and append them to the shard files,
+    in parallel over worker processes when jobs > 1. Shards are written next to their
+    final names and moved in place once the whole input is done, like atomic_output().
+    Cache lookups and writes stay in the main process
+    """
+    limits = converter_args[5] if len(converter_args) > 5 else {}
+    out_files = shard_files(out_file, shards)
+    tmp_files = ['{}.{}.tmp'.format(shard_file, os.getpid()) for shard_file in out_files]
+    try:
+        for tmp_file in tmp_files:
+            open(tmp_file, mode='w', encoding='utf-8').close()
+        with contextlib.ExitStack() as stack:
+            pool = None
+            if jobs > 1:
+                pool = stack.enter_context(multiprocessing.Pool(processes=min(jobs, shards), initializer=init_converter,
+                                                                initargs=converter_args))
+            else:
+                init_converter(*converter_args)
+
+            for spelling_lists in input_group_windows(codes):
+                representatives = [spellings[0] for spellings in spelling_lists]
+                cached = rejected_codes(representatives, limits)
+                if cache is not None:
+                    cached.update(get_cached_results(cache, [u for u in representatives if u not in cached]))
+                tasks = []
+                for k, tmp_file in enumerate(tmp_files):
+                    shard = [(spellings, cached.get(spellings[0])) for spellings in spelling_lists[k::shards]]
+                    tasks.append((tmp_file, shard, output_format, graph))
+
+                if pool is not None:
+                    results = pool.starmap(write_shard, tasks, chunksize=1)
+                else:
+                    results = [write_shard(*task) for task in tasks]
+
+                for errors, converted in results:
+                    for error in errors:
+                        report_error(error)
+                    if cache is not None:
+                        for u, result in converted:
+                            if not isinstance(result[1], RejectedCode):
+                                put_cached_result(cache, u, *result)
+                if cache is not None:
+                    cache.commit()
+
+        for tmp_file, shard_file in zip(tmp_files, out_files):
+            os.replace(tmp_file, shard_file)
+    except BaseException:
+        for tmp_file in tmp_files:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        raise
 
-    # write out prefixes followed by linebreak
+
+# --------------------------------------------------
+def get_cached_results(cache, codes):
+    """(record, error) from the ResultCache for the codes found in it"""
+    return {u: (record, None if error is None else ConversionError(*error))
+            for u, (record, error) in cache.get_many(codes).items()}
+
+
+# --------------------------------------------------
+def put_cached_result(cache, code, record, error=None):
+    """Store a (record, error) result, errors keep their diagnostic so cached failures are reported like fresh ones"""
+    cache.put(code, [record, None if error is None else [str(error), error.diagnostic]])
+
+
+# --------------------------------------------------
+@contextlib.contextmanager
+def atomic_output(out_file, encoding='utf-8-sig'):
+    """
+    Open a large buffered text file next to out_file and move it over out_file once
+    everything is written, so a failed run leaves the previous out_file untouched
+    rather than half written
+    """
+    tmp_file = '{}.{}.tmp'.format(out_file, os.getpid())
+    try:
+        with open(tmp_file, mode='w', encoding=encoding, buffering=output_buffer_size) as f:
+            yield f
+        os.replace(tmp_file, out_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+# --------------------------------------------------
+def write_ttl_header(f):
+    """
+    Write out prefixes and the definition property followed by linebreak
+    """
     for p in prefix_dict_list:
         print('@prefix {} <{}> .'.format(p['prefix'], p['namespace']), file=f)
     print('', file=f)
@@ -853,92 +2003,432 @@ def main():
     print('	rdfs:label "definition" .', file=f)
     print('', file=f)
 
-    for u in valid_SI_input_list:
-        tree = si_grammar.parse(u)
-        result = transformer().transform(tree)
+
+# --------------------------------------------------
+def mapping_digest(mapping_list):
+    """sha256 of the IRIs a UCUM code maps to"""
+    return hashlib.sha256('\n'.join(mapping_list).encode('utf-8')).hexdigest()
+
+
+# --------------------------------------------------
+def read_ttl_blocks(out_file):
+    """
+    Split a previously written output file into its unit blocks keyed by subject line
+    """
+    blocks = {}
+    if not os.path.exists(out_file):
+        return blocks
+    with open(out_file, mode='r', encoding='utf-8-sig') as f:
+        text = f.read()
+    for block in text.split('\n\n'):
+        if block.startswith('unit:'):
+            blocks.setdefault(block.split('\n', 1)[0], block + '\n')
+    return blocks
+
+
+# --------------------------------------------------
+def incremental_convert(input_list, out_file, manifest_file, converter_args, jobs, cache=None):
+    """
+    Re-convert only the input codes that are new, or whose mapping rows changed since
+    the run recorded in manifest_file, and splice them into the blocks of the existing
+    out_file. A change to the script, parser, SI, prefix or exponents files can touch
+    every code so it falls back to converting everything.
+    """
+    SI_file, prefix_file, exponents_file, ucum_files, parser = converter_args[:5]
+    limits = converter_args[5] if len(converter_args) > 5 else {}
+    file_hashes = {
+        'script': file_digest(os.path.abspath(__file__)),
+        'parser': parser,
+        'SI': file_digest(SI_file),
+        'prefix': file_digest(prefix_file),
+        'exponents': file_digest(exponents_file),
+        'limits': [limits.get('max_components'), limits.get('max_length')],
+    }
+    mapping_hashes = {ucum_file: file_digest(ucum_file) for ucum_file in ucum_files}
+
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file, mode='r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    if manifest.get('files') == file_hashes:
+        manifest_codes = manifest.get('codes', {})
+    else:
+        manifest_codes = {}
+    blocks = read_ttl_blocks(out_file) if manifest_codes else {}
+
+    # Only rebuild the mapping index to compare per code digests if a mapping csv changed
+    mapping_index = None
+    if manifest_codes and manifest.get('mapping_files') != mapping_hashes:
+        ontology_mapping_list = []
+        for ucum_file in ucum_files:
+            ontology_mapping_list += read_csv_dicts(ucum_file)
+        mapping_index = build_mapping_index(ontology_mapping_list)
+
+    # Manifest entries are per group of spellings, see group_input_codes(). The manifest
+    # already keeps every group of the input so grouping it all in one go costs no more
+    # than the index itself, input_list can be an iterator and is not held as a list
+    groups = group_input_codes(input_list)
+    codes = {}
+    todo = []
+    for g, spellings in groups.items():
+        entry = manifest_codes.get(g)
+        # Codes that failed last time fail the same way with unchanged input files,
+        # a new spelling of a unit changes the ucum_code values of its block and
+        # codes rejected by a limit are tried again as they may have timed out
+        if entry is None or entry.get('spellings') != spellings or entry.get('rejected') or \
+                (entry['subject'] is not None and entry['subject'] not in blocks):
+            todo.append(g)
+        elif entry['subject'] is not None and mapping_index is not None and \
+                mapping_digest(mapping_index.get(entry['key'], [])) != entry['mappings']:
+            todo.append(g)
+        else:
+            codes[g] = entry
+
+    new_blocks = {}
+    if todo:
+        todo_spellings = [groups[g] for g in todo]
+        for g, (record, error) in zip(todo, convert_groups(todo_spellings, converter_args, jobs, cache,
+                                                            with_errors=True)):
+            if record is None:
+                codes[g] = {'spellings': groups[g], 'subject': None}
+                if isinstance(error, RejectedCode):
+                    codes[g]['rejected'] = True
+                continue
+            ttl = format_record_ttl(record)
+            new_blocks[g] = ttl
+            codes[g] = {
+                'spellings': groups[g],
+                'subject': ttl.split('\n', 1)[0],
+                'key': canonical_ucum_key(record['ucum_code']),
+                'mappings': mapping_digest(record['mapping_list']),
+            }
+
+    with atomic_output(out_file) as f:
+        write_ttl_header(f)
+        for g in groups:
+            if g in new_blocks:
+                f.write(new_blocks[g] + '\n')
+            elif codes[g]['subject'] is not None:
+                f.write(blocks[codes[g]['subject']] + '\n')
+
+    # Written after out_file so the manifest never describes blocks that aren't there
+    with atomic_output(manifest_file, encoding='utf-8') as f:
+        json.dump({'files': file_hashes, 'mapping_files': mapping_hashes,
+                   'codes': {g: codes[g] for g in groups}}, f, ensure_ascii=False, indent=1)
+
+    print(f'Incremental run: converted {len(todo)} of {len(groups)} units, reused the rest from {out_file}')
+
+
+# --------------------------------------------------
+def service_response(context, request):
+    """
+    Convert a batch request, {"codes": [...]} or a plain list of codes, into
+    {"results": [...]} with one record per code in request order, or an entry with
+    the error message and its diagnostic for codes that could not be processed
+    """
+    if isinstance(request, dict):
+        codes = request.get('codes', [])
+    else:
+        codes = request
+    if isinstance(codes, str):
+        codes = [codes]
+    if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+        return {'error': 'Request should be {"codes": [...]} or a list of codes'}
+
+    results = []
+    for code in codes:
+        record, error = context.convert_with_error(code)
+        if error is None:
+            results.append(record)
+        else:
+            warn(error)
+            results.append({'input': code, 'error': str(error), 'diagnostic': error.diagnostic})
+    return {'results': results}
+
+
+# --------------------------------------------------
+def serve_stdio(context):
+    """
+    Answer one JSON request per line on STDIN with one JSON response per line on STDOUT
+    Conversion messages go to STDERR so they don't break up the responses
+    """
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
         try:
-            res_flat = flatten(result)
-        except:
-            print(f"Ran into error with flatten when processing '{u}'")
-        # print(u, res_flat)
-
-        new_dict_list = []
-        # Convert the inputs into a preprocessed list of dict
-        for r in res_flat:
-            pre_process_unit_list(r, u, new_dict_list)
-
-        # Determine type SI vs conventional
-        # to optionally Add SI codes in next step
-        # TODO could probably do this better
-        type_list = []
-        for r in new_dict_list:
-            type_list.append(r['type'])
-
-        # Add codes to dict:
-        for r in new_dict_list:
-            # Optionally Add SI codes
-            if 'conventional' not in type_list:
-                # create the SI code from prefix and unit
-                gen_symbol_code(result=r, mapping_dict=ucum_si_units_dict, code_str='si_code')
-
-            # create the UCUM codes from prefix and unit
-            code = r['prefix'] + r['unit']
-            r.update({'ucum_code': code})
-        # print(u, new_dict_list)
-
-        # Function to generate list of UCUM codes from results dict list
-        # Permute Possible UCUM strings
-        UCUM_SI_list = gen_si_ucum_list(dict_list=new_dict_list)
-        # print(UCUM_SI_list)
-
-        # Function to create labels from units and prefixes
-        # pass in desired language SI unit, prefix and exponents dicts + label_lan
-        for r in new_dict_list:
-            gen_label_parts(result=r, SI_unit_label_dict=ucum_unit_label_en_dict, prefix_dict=prefix_en_dict, exponents_dict=exponents_en_dict, label_lan='label_en')
-        # print(u, new_dict_list)
-
-        # Function to split numerator and denominator into two lists
-        numerator_list = []
-        denominator_list = []
-        for r in new_dict_list:
-            split_num_denom(result=r, numerator_list=numerator_list, denominator_list=denominator_list)
-        # print(u, 'num:', numerator_list, 'denom:', denominator_list)
-
-        # # Sort in canonical alphabetical order
+            request = json.loads(line)
+        except ValueError:
+            response = {'error': 'Invalid JSON request'}
+        else:
+            with contextlib.redirect_stdout(sys.stderr):
+                response = service_response(context, request)
+        print(json.dumps(response, ensure_ascii=False), flush=True)
+
+
+# --------------------------------------------------
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /convert with a JSON batch request or GET /convert?code=m/s&code=kg.m-3
+    Uses the ConversionContext attached to the server by serve_http()
+    """
+
+    def do_GET(self):
+        url = parse.urlsplit(self.path)
+        if url.path != '/convert':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        codes = parse.parse_qs(url.query).get('code', [])
+        self.send_json(200, service_response(self.server.context, codes))
+
+    def do_POST(self):
+        if parse.urlsplit(self.path).path != '/convert':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        length = int(self.headers.get('Content-Length', 0))
         try:
-            numerator_list = sorted(numerator_list, key=lambda k: (k['ucum_code'].casefold(), k))
-            denominator_list = sorted(denominator_list, key=lambda k: (k['ucum_code'].casefold(), k))
-            # print(u, numerator_list, denominator_list)
-        except:
-            print(f"Could not process '{u}' at sorting step")
+            request = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_json(400, {'error': 'Invalid JSON request'})
+            return
+        self.send_json(200, service_response(self.server.context, request))
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+# --------------------------------------------------
+def serve_http(context, port):
+    """Serve conversion requests on localhost until interrupted"""
+    server = HTTPServer(('127.0.0.1', port), ConversionRequestHandler)
+    server.context = context
+    warn(f'Serving conversions on http://127.0.0.1:{port}/convert')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# Conversion stages timed by --profile, in pipeline order
+profile_stages = ['lookup', 'parse', 'compile', 'si_symbols', 'labels', 'sort', 'label', 'definition', 'codes',
+                  'mapping', 'serialize']
+
+
+# --------------------------------------------------
+class StageProfiler:
+    """
+    Wall time of each conversion stage per input code for --profile.
+    start() a code, then lap() at the end of each stage to charge it the time
+    since the previous lap, add() charges time measured elsewhere
+    """
+
+    def __init__(self):
+        self.code_stages = {}
+        self.stages = None
+        self.last = None
 
-        # # Generate canonical term label
-        label = canonical_nc_label(numerator_list=numerator_list, denominator_list=denominator_list, label_lan='label_en')
+    def start(self, code):
+        self.stages = self.code_stages.setdefault(code, {})
+        self.last = time.perf_counter()
 
-        # Generate canonical english definition
-        definition_en = canonical_en_definition(numerator_list=numerator_list, denominator_list=denominator_list,
-                                                unit_def_dict=ucum_unit_def_en_dict, prefix_numbers_dict=prefix_numbers_dict, ucum_unit_label_en_dict=ucum_unit_label_en_dict, exponents_en_dict=exponents_en_dict, label_lan='label_en')
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
 
-        # Generate canonical SI code e.g. `Pa s`
-        # First pass complete, Later can fix superscript issue with fstrings TODO
-        # print(u, '->', canonical_si_code(numerator_list=numerator_list,denominator_list=denominator_list))
-        si_code = canonical_si_code(numerator_list=numerator_list, denominator_list=denominator_list)
+    def add(self, code, stage, seconds):
+        stages = self.code_stages.setdefault(code, {})
+        stages[stage] = stages.get(stage, 0.0) + seconds
 
-        # Generate canonical UCUM code
-        ucum_code = canonical_ucum_code(numerator_list=numerator_list, denominator_list=denominator_list)
-        #print(ucum_code)
+    def timed(self, stage, function):
+        """Wrap a function taking a record so its time is charged to the record's input code"""
+        def timed_function(record):
+            start = time.perf_counter()
+            result = function(record)
+            self.add(record['input'], stage, time.perf_counter() - start)
+            return result
+        return timed_function
 
-        # Map UCUM codes to external Ontologies
-        # LATER TODO change this to use the mappings of canonical UCUM strings by calling phase 2 on Simon’s mappings
-        mapping_list = temp_ucum_map(ucum_list=UCUM_SI_list, ontology_mapping_list=ontology_mapping_list)
-        #print(mapping_list)
 
-        # Format ttl for SI parser results
-        # We can alternatively pass ucum_code instead of si_nc_name_iri
-        # as iri to circumvent NC name mapping
-        print(format_si_ttl(iri=ucum_code, label=label, si_code=si_code, ucum_code=ucum_code, definition_en=definition_en, mapping_list=mapping_list), file=f)
+# --------------------------------------------------
+def percentile(sorted_values, q):
+    """Nearest rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+# --------------------------------------------------
+def profile_summary(profiler, top_n, run_seconds):
+    """
+    Summarize a StageProfiler into totals and percentiles per stage and per code
+    plus the top_n slowest codes with their stage breakdown
+    """
+    code_totals = {code: sum(stages.values()) for code, stages in profiler.code_stages.items()}
+    total = sum(code_totals.values())
+
+    stages = {}
+    for stage in profile_stages:
+        times = sorted(s[stage] for s in profiler.code_stages.values() if stage in s)
+        if not times:
+            continue
+        stage_total = sum(times)
+        stages[stage] = {
+            'codes': len(times),
+            'total_seconds': stage_total,
+            'share': stage_total / total if total else 0.0,
+            'p50_ms': percentile(times, 50) * 1000,
+            'p90_ms': percentile(times, 90) * 1000,
+            'p99_ms': percentile(times, 99) * 1000,
+            'max_ms': times[-1] * 1000,
+        }
+
+    per_code = sorted(code_totals.values())
+    slowest = sorted(code_totals, key=code_totals.get, reverse=True)[:top_n]
+    return {
+        'run_seconds': run_seconds,
+        'codes': len(code_totals),
+        'total_seconds': total,
+        'per_code': {
+            'p50_ms': percentile(per_code, 50) * 1000,
+            'p90_ms': percentile(per_code, 90) * 1000,
+            'p99_ms': percentile(per_code, 99) * 1000,
+            'max_ms': per_code[-1] * 1000 if per_code else 0.0,
+        },
+        'stages': stages,
+        'slowest': [{'code': code, 'ms': code_totals[code] * 1000,
+                     'stages_ms': {stage: t * 1000 for stage, t in profiler.code_stages[code].items()}}
+                    for code in slowest],
+    }
+
+
+# --------------------------------------------------
+def print_profile_summary(summary):
+    """Print the profile_summary() tables"""
+    print(f"Profiled {summary['codes']} codes, {summary['total_seconds']:.3f}s converting and serializing "
+          f"of {summary['run_seconds']:.3f}s run time")
+    print('{:<18}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}'.format('stage', 'total s', 'share', 'p50 ms', 'p90 ms',
+                                                             'p99 ms', 'max ms'))
+    rows = list(summary['stages'].items()) + [('per code', dict(summary['per_code'], total_seconds=summary['total_seconds'],
+                                                                share=1.0))]
+    for stage, t in rows:
+        print('{:<18}{:>10.3f}{:>7.1f}%{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}'.format(
+            stage, t['total_seconds'], t['share'] * 100, t['p50_ms'], t['p90_ms'], t['p99_ms'], t['max_ms']))
+    print(f"Slowest {len(summary['slowest'])} codes:")
+    for slow in summary['slowest']:
+        worst = max(slow['stages_ms'], key=slow['stages_ms'].get)
+        print(f"  {slow['ms']:9.3f} ms  {slow['code']}  (mostly {worst})")
 
 
-        # --------------------------------------------------
+# --------------------------------------------------
+def read_input_codes(input_file):
+    """
+    Yield the code in the first column of each row of the input csv, one row at a time
+    """
+    with open(input_file, mode='r', encoding='utf-8-sig') as input:
+        for row in csv.reader(input, delimiter=','):
+            yield row[0]
+
+
+# --------------------------------------------------
+def serialize_records(records, formatter=format_record_ttl):
+    """
+    Yield the formatted text of each converted record, skipping inputs that could not be processed
+    """
+    for record in records:
+        if record is not None:
+            yield formatter(record)
+
+
+# --------------------------------------------------
+def main():
+    """Main function to test if input is SI or UCUM then parse and covert and post"""
+    run_start = time.perf_counter()
+    args = get_args()
+    input_file = args.input
+    out_file = args.output
+    # 0 turns a limit off
+    limits = {'max_components': args.max_components or None, 'max_length': args.max_length or None,
+              'timeout': args.timeout or None}
+    converter_args = (args.SI, args.prefix, args.exponents,
+                      [args.ucum1, args.ucum2, args.ucum3, args.ucum4, args.ucum5], args.parser, limits)
+
+    if args.format == 'ttl' and args.shards > 1:
+        die('--shards needs --format nt or nq, Turtle output has a single header')
+    if args.format != 'ttl' and args.manifest:
+        die('--manifest only supports --format ttl')
+
+    if args.serve:
+        init_converter(*converter_args)
+        context = converter_state['context']
+        if args.serve == 'http':
+            serve_http(context, args.port)
+        else:
+            serve_stdio(context)
+        return
+
+    # Input codes are streamed from the input file and grouped by canonical UCUM key
+    # (read -> group -> convert -> serialize), memory grows with the number of distinct
+    # codes but not with repeated rows
+    codes = read_input_codes(input_file)
+
+    profiler = None
+    if args.profile:
+        # Every code is converted in this process so each stage can be timed
+        profiler = converter_state['profiler'] = StageProfiler()
+        args.jobs = 1
+        args.no_cache = True
+
+    # Reuse records converted by earlier runs with the same script, input files and parser
+    cache = None
+    if not args.no_cache:
+        cache = ResultCache(os.path.join(cache_dir, 'nc_name_results.sqlite'), os.path.abspath(__file__),
+                            [args.SI, args.prefix, args.exponents] + converter_args[3], options=[args.parser])
+
+    with contextlib.ExitStack() as stack:
+        if args.reject_report:
+            rejects = csv.writer(stack.enter_context(atomic_output(args.reject_report, encoding='utf-8')))
+            rejects.writerow(['code', 'reason'])
+            converter_state['rejects'] = rejects
+        if args.diagnostics:
+            converter_state['diagnostics'] = stack.enter_context(atomic_output(args.diagnostics, encoding='utf-8'))
+
+        if args.manifest:
+            # The manifest compares the whole input against the previous run
+            incremental_convert(codes, out_file, args.manifest, converter_args, args.jobs, cache)
+        elif args.shards > 1:
+            write_shards(codes, out_file, args.shards, args.format, args.graph, converter_args,
+                         args.jobs, cache)
+        else:
+            spelling_lists = itertools.chain.from_iterable(input_group_windows(codes))
+            formatter = record_formatter(args.format, args.graph)
+            if profiler is not None:
+                formatter = profiler.timed('serialize', formatter)
+
+            # Open outfile
+            with atomic_output(out_file, encoding='utf-8-sig' if args.format == 'ttl' else 'utf-8') as f:
+                if args.format == 'ttl':
+                    write_ttl_header(f)
+                for text in serialize_records(convert_groups(spelling_lists, converter_args, args.jobs, cache),
+                                              formatter):
+                    f.write(text)
+
+    if profiler is not None:
+        summary = profile_summary(profiler, args.profile_top, time.perf_counter() - run_start)
+        print_profile_summary(summary)
+        if args.profile_json:
+            with atomic_output(args.profile_json, encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=1)
+
+
+# --------------------------------------------------
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
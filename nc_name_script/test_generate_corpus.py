@@ -0,0 +1,48 @@
+"""
+Tests for generate_corpus.py, run with python -m pytest from nc_name_script/
+"""
+
+import contextlib
+import io
+
+import generate_corpus
+import nc_name
+
+
+# --------------------------------------------------
+def default_vocabulary(dict_only=False):
+    return generate_corpus.load_vocabulary(nc_name.default_SI_file, nc_name.default_prefix_file,
+                                           nc_name.default_exponents_file, dict_only=dict_only)
+
+
+# --------------------------------------------------
+def test_default_corpus_has_conventional_terminals():
+    """The default seed and rates draw conventional terminals of the grammar"""
+    context = nc_name.ConversionContext()
+    conventional = [code for code, label in generate_corpus.generate_codes(1000, 0, default_vocabulary())
+                    if label.startswith('valid') and
+                    any(r.type == 'conventional' for r in context.parse_components(code))]
+    assert len(conventional) > 50
+
+
+# --------------------------------------------------
+def test_labels_match_conversion():
+    """Codes labelled valid convert with the dict, valid:no_dict_entry ones parse but don't, invalid ones fail"""
+    context = nc_name.ConversionContext()
+    for code, label in generate_corpus.generate_codes(500, 0, default_vocabulary()):
+        with contextlib.redirect_stdout(io.StringIO()):
+            record, error = context.convert_with_error(code)
+        if label == 'valid':
+            assert error is None, code
+        elif label == 'valid:no_dict_entry':
+            assert error is not None and error.diagnostic['stage'] == 'convert', code
+        else:
+            assert error is not None, (code, label)
+
+
+# --------------------------------------------------
+def test_dict_only():
+    """--dict-only only keeps conventional terminals with an SI dict entry"""
+    vocab = default_vocabulary(dict_only=True)
+    assert set(vocab['conventional']) <= vocab['in_dict']
+    assert all(label != 'valid:no_dict_entry' for _, label in generate_corpus.generate_codes(500, 0, vocab))
@@ -0,0 +1,90 @@
+"""
+Tests for nc_name.py, run with python -m pytest from nc_name_script/
+"""
+
+import itertools
+import os
+import pickle
+
+import pytest
+
+import nc_name
+
+# Codes where a leading "/" or spaces could be read differently by the grammar and the fast path
+edge_codes = ['/m', ' /m', '  /m.s', ' / m', '/ m', '/m/s', '/s2.kg', ' m/s', 'm / s', '  m.s-1', 'm.qq', '10.m']
+
+
+# --------------------------------------------------
+def parsed(context, code):
+    """
+    (ucum_code, type, exponent) of each component of code, None if it can't be parsed
+    The parsers raise different lark exceptions for the same bad code so those aren't compared
+    """
+    try:
+        return [(r.ucum_code, r.type, r.exponent) for r in context.parse_components(code)]
+    except Exception:
+        return None
+
+
+# --------------------------------------------------
+def equivalence_codes():
+    """Production list, test inputs and the edge cases"""
+    codes = list(edge_codes)
+    for input_file in [os.path.join('data', 'production', 'working_pooled_unit_codes.csv'),
+                       os.path.join('data', 'test', 'test1.csv'), os.path.join('data', 'test', 'test2.csv')]:
+        codes += nc_name.read_input_codes(os.path.join(nc_name.script_dir, input_file))
+    return codes
+
+
+# --------------------------------------------------
+@pytest.mark.parametrize('parser,fast_path', [('earley', True), ('lalr', False), ('lalr', True),
+                                              ('lalr-inline', False), ('lalr-inline', True)])
+def test_parsers_agree(parser, fast_path):
+    """Every parser, with and without the fast path, reads each code as the Earley parser does"""
+    reference = nc_name.ConversionContext(parser='earley', fast_path=False)
+    context = nc_name.ConversionContext(parser=parser, fast_path=fast_path)
+    for code in equivalence_codes():
+        assert parsed(context, code) == parsed(reference, code), code
+
+
+# --------------------------------------------------
+def test_leading_slash():
+    """A leading "/", with or without spaces before it, makes every component a denominator"""
+    for parser in ['earley', 'lalr', 'lalr-inline']:
+        context = nc_name.ConversionContext(parser=parser, fast_path=False)
+        for code in ['/m.s', ' /m.s', ' / m.s']:
+            assert parsed(context, code) == [('m', 'metric', -1), ('s', 'metric', -1)], (parser, code)
+
+
+# --------------------------------------------------
+@pytest.mark.parametrize('content', [b'', b'\x80\x05\x95', pickle.dumps({'vocab_forward': {}}),
+                                     pickle.dumps({'sources': None, 'vocab_forward': {}, 'vocab_reverse': {},
+                                                   'mapping_index': {}}),
+                                     pickle.dumps(['not', 'a', 'snapshot'])])
+def test_bad_vocab_snapshot(tmp_path, content):
+    """A truncated or malformed snapshot reads as missing so the tables are rebuilt"""
+    snapshot_file = tmp_path / 'vocab.pickle'
+    snapshot_file.write_bytes(content)
+    assert nc_name.read_vocab_snapshot(str(snapshot_file), [nc_name.default_SI_file]) is None
+    assert nc_name.read_vocab_snapshot(str(tmp_path / 'missing.pickle'), [nc_name.default_SI_file]) is None
+
+
+# --------------------------------------------------
+@pytest.mark.parametrize('output_format', ['ttl', 'nt'])
+def test_spellings_across_window_boundary(output_format):
+    """A unit spelled again in a later window only adds the ucum_code triples of the new spellings"""
+    codes = ['m/s', 'kg', 'm.s-1', 's-1.m', 'kg', 'm/s']
+    converter_args = (nc_name.default_SI_file, nc_name.default_prefix_file, nc_name.default_exponents_file,
+                      nc_name.default_ucum_files, 'earley')
+    spelling_lists = itertools.chain.from_iterable(nc_name.input_group_windows(codes, 2))
+    formatter = nc_name.record_formatter(output_format, None)
+    text = ''.join(nc_name.serialize_records(nc_name.convert_groups(spelling_lists, converter_args, 1), formatter))
+
+    whole = ''.join(nc_name.serialize_records(
+        nc_name.convert_groups(nc_name.group_input_codes(codes).values(), converter_args, 1), formatter))
+    if output_format == 'ttl':
+        assert text.count('a owl:NamedIndividual') == whole.count('a owl:NamedIndividual') == 2
+        assert text.count('unit:ucum_code') == whole.count('unit:ucum_code') == 4
+        assert 'unit:m.s-1\n  unit:ucum_code "s-1.m" .\n\n' in text
+    else:
+        assert sorted(text.splitlines()) == sorted(whole.splitlines())
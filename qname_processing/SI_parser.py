@@ -18,12 +18,16 @@ UCUM list from QUDT OM UO and OBOE
 """
 
 import argparse
+import os
 import sys
 import csv
 import collections.abc
 import re
 from lark import Lark, Tree, Transformer
-from itertools import permutations
+
+# VocabRegistry is shared with the other scripts, see shared/unit_tools.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'shared'))
+from unit_tools import VocabRegistry
 
 prefix_dict_list = [
     {'prefix': 'rdf:', 'namespace': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'},
@@ -252,6 +256,9 @@ NON_PRE_METRIC: "au" | "°C" | "°" | "d" | "h" | "min" | "′"
 ''')
 # Note the rules need to be in order if we have  "m" | "mol" then mol won't be found
 
+# Simple UCUM component: symbol followed by an optional signed exponent e.g., 'km-2'
+ucum_component_regex = re.compile(r"^(.*[^0-9-])(-?[0-9]+)?$")
+
 
 # --------------------------------------------------
 def flatten(x):
@@ -266,22 +273,6 @@ def flatten(x):
         return [x]
 
 
-# --------------------------------------------------
-def get_key(val, dict):
-    for key, value in dict.items():
-        if val == value:
-            return key
-    return "key doesn't exist"
-
-
-# --------------------------------------------------
-def get_value(key, dict):
-    for k, value in dict.items():
-        if k == key:
-            return value
-    return None
-
-
 # --------------------------------------------------
 def pre_process_unit_list(result, original, dict_list):
     """
@@ -296,7 +287,7 @@ def pre_process_unit_list(result, original, dict_list):
     else:
         prefix = ''
 
-    if get_value(key="operator", dict=result) == "/":
+    if result.get("operator") == "/":
         # if it doesn't have an exponent key create one at -1 else change exp to -
         if "exponent" not in result:
             x = {'prefix': prefix, 'type': result['type'], 'unit': result['unit'], 'exponent': int('-1')}
@@ -323,59 +314,29 @@ def pre_process_unit_list(result, original, dict_list):
 
 
 # --------------------------------------------------
-def gen_symbol_code(result, mapping_dict, code_str):
+def gen_symbol_code(result, vocab, table, code_str):
     """
-    Add code_str based on prefix and unit
+    Add code_str based on prefix and the unit symbol from the vocab table
     """
-    unit = get_value(result['unit'], mapping_dict)
+    unit = vocab.value(table, result['unit'])
     code = result['prefix'] + unit
     result.update({code_str: code})
 
 
 # --------------------------------------------------
-def gen_si_ucum_list(dict_list):
-    """
-    Create permutations of possible UCUM strings for input unit list
-    E.g., 'm.s-1' -> ['m.s-1', 's-1.m']
-    https://www.geeksforgeeks.org/generate-all-the-permutation-of-a-list-in-python/
-    At the moment only handels the ucum "." cases not the "/" cases
-    TODO add the / UCUM cases
-    """
-    return_list = []
-    code_exp_list = []
-    for d in dict_list:
-        if d['exponent'] == 1:
-            exp = ''
-        else:
-            exp = str(d['exponent'])
-        x = d['ucum_code'] + exp
-        code_exp_list.append(x)
-    code_exp_list = list(permutations(code_exp_list))
-
-    for p in code_exp_list:
-        ucum_str_list = []
-        for i in p:
-            ucum_str_list.append(i)
-        outstr = '.'.join(ucum_str_list)
-        return_list.append(outstr)
-    return return_list
-
-
-# --------------------------------------------------
-def gen_label_parts(result, SI_unit_label_dict, prefix_dict, exponents_dict, label_lan):
+def gen_label_parts(result, vocab, label_lan):
     """
     Create labels from units and prefixes
     TODO add special case for unit = are to print hectare instead of hectoare etc
     deci might be the only exception
     """
-    if get_value(result['prefix'], prefix_dict) is not None:
-        prefix = get_value(result['prefix'], prefix_dict)
-    else:
+    prefix = vocab.value(f'prefix_{label_lan}', result['prefix'])
+    if prefix is None:
         prefix = ''
-    unit = get_value(result['unit'], SI_unit_label_dict)
+    unit = vocab.value(f'unit_{label_lan}', result['unit'])
     power = str(result['exponent'])
     power = power.replace('-', '')
-    power = get_value(power, exponents_dict)
+    power = vocab.value(f'exponent_{label_lan}', power)
     if power is None:
         label_str = prefix + unit
     else:
@@ -431,21 +392,21 @@ def canonical_nc_label(numerator_list, denominator_list, label_lan):
 
 
 # --------------------------------------------------
-def retrieve_exponent(in_arg, exponents_en_dict):
+def retrieve_exponent(in_arg, vocab, label_lan):
     power = str(in_arg['exponent'])
     power = power.replace('-', '')
-    power = get_value(power, exponents_en_dict)
+    power = vocab.value(f'exponent_{label_lan}', power)
     return power
 
 
 # --------------------------------------------------
-def canonical_en_definition_helper(units_list, unit_label_en_dict, exponents_en_dict, prefix_numbers_dict):
+def canonical_en_definition_helper(units_list, vocab, label_lan):
     return_lst = []
     for u in units_list:
-        unit = get_value(u['unit'], unit_label_en_dict)
-        power = retrieve_exponent(u, exponents_en_dict)
-        if get_value(key=u['prefix'], dict=prefix_numbers_dict) is not None:
-            prefix_num = get_value(key=u['prefix'], dict=prefix_numbers_dict)
+        unit = vocab.value(f'unit_{label_lan}', u['unit'])
+        power = retrieve_exponent(u, vocab, label_lan)
+        prefix_num = vocab.value('prefix_num', u['prefix'])
+        if prefix_num is not None:
             prefix_val = f'10{prefix_num}'
         else:
             prefix_val = '1'
@@ -457,14 +418,14 @@ def canonical_en_definition_helper(units_list, unit_label_en_dict, exponents_en_
 
 
 # --------------------------------------------------
-def canonical_en_definition(numerator_list, denominator_list, unit_def_dict, prefix_numbers_dict, SI_unit_label_en_dict, exponents_en_dict, label_lan):
+def canonical_en_definition(numerator_list, denominator_list, vocab, label_lan):
     definition = None
     # Case 1 no denominators, and only a SI base unit with no exponent
     if not denominator_list and len(numerator_list) == 1 and numerator_list[0]['exponent'] == 1:
         # Without prefix:
         if numerator_list[0]['prefix'] == '':
             for n in numerator_list:
-                definition = get_value(key=n['unit'], dict=unit_def_dict)
+                definition = vocab.value('unit_definition_en', n['unit'])
         # special case for kg
         elif numerator_list[0]['prefix'] == 'k' and numerator_list[0]['unit'] == 'g':
             kilogram_def_en = 'An SI base unit which 1) is the SI unit of mass and 2) is defined by taking the fixed numerical value of the Planck constant, h, to be 6.626 070 15 × 10⁻³⁴ when expressed in the unit joule second, which is equal to kilogram square metre per second, where the metre and the second are defined in terms of c and ∆νCs.'
@@ -472,35 +433,26 @@ def canonical_en_definition(numerator_list, denominator_list, unit_def_dict, pre
         # Regular With prefix case
         elif numerator_list[0]['prefix'] != '':
             for n in numerator_list:
-                si_label = get_value(key=n['unit'], dict=SI_unit_label_en_dict)
-                prefix_num = get_value(key=n['prefix'], dict=prefix_numbers_dict)
+                si_label = vocab.value(f'unit_{label_lan}', n['unit'])
+                prefix_num = vocab.value('prefix_num', n['prefix'])
                 definition = f'A unit which is equal to 10{prefix_num} {si_label}.'
     # Case 2 no denominators
     elif not denominator_list:
-        return_lst = canonical_en_definition_helper(units_list=numerator_list, unit_label_en_dict=SI_unit_label_en_dict,
-                                                    exponents_en_dict=exponents_en_dict,
-                                                    prefix_numbers_dict=prefix_numbers_dict)
+        return_lst = canonical_en_definition_helper(units_list=numerator_list, vocab=vocab, label_lan=label_lan)
         def_start = 'A unit which is equal to '
         definition_mid = ' by '.join(return_lst)
         definition = def_start + definition_mid + '.'
     # Case 3 no numerators
     elif not numerator_list:
-        return_lst = canonical_en_definition_helper(units_list=denominator_list, unit_label_en_dict=SI_unit_label_en_dict,
-                                                    exponents_en_dict=exponents_en_dict,
-                                                    prefix_numbers_dict=prefix_numbers_dict)
+        return_lst = canonical_en_definition_helper(units_list=denominator_list, vocab=vocab, label_lan=label_lan)
         def_start = 'A unit which is equal to the reciprocal of '
         definition_mid = ' by '.join(return_lst)
         definition = def_start + definition_mid + '.'
     # Case 4 mix of numerators and denominators
     else:
-        num_list = canonical_en_definition_helper(units_list=numerator_list, unit_label_en_dict=SI_unit_label_en_dict,
-                                                    exponents_en_dict=exponents_en_dict,
-                                                    prefix_numbers_dict=prefix_numbers_dict)
-
-        denom_list = canonical_en_definition_helper(units_list=denominator_list,
-                                                    unit_label_en_dict=SI_unit_label_en_dict,
-                                                    exponents_en_dict=exponents_en_dict,
-                                                    prefix_numbers_dict=prefix_numbers_dict)
+        num_list = canonical_en_definition_helper(units_list=numerator_list, vocab=vocab, label_lan=label_lan)
+
+        denom_list = canonical_en_definition_helper(units_list=denominator_list, vocab=vocab, label_lan=label_lan)
         def_start = 'A unit which is equal to '
         def_num = ' by '.join(num_list)
         def_denom = ' by '.join(denom_list)
@@ -539,6 +491,78 @@ def canonical_ucum_code(numerator_list, denominator_list):
     return '.'.join(return_lst)
 
 
+# --------------------------------------------------
+def split_ucum_str(ucum_str):
+    """
+    Split a UCUM string into (symbol, exponent) pairs the same way pre_process_unit_list
+    folds operators into exponents e.g., 'm/s2' -> [('m', 1), ('s', -2)]
+    A leading "/" makes every component a denominator
+    Operators inside brackets e.g., 'B[10.nV]' are part of the symbol
+    Returns None if the string isn't made up of simple components
+    """
+    if not ucum_str or any(c in ucum_str for c in '(){}*^ '):
+        return None
+    invert = ucum_str[0] == '/'
+    if invert:
+        ucum_str = ucum_str[1:]
+
+    # Split on operators outside of brackets keeping track of the operator
+    parts = []
+    operator = '.'
+    depth = 0
+    start = 0
+    for i, c in enumerate(ucum_str):
+        if c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+        elif c in './' and depth == 0:
+            parts.append((operator, ucum_str[start:i]))
+            operator = c
+            start = i + 1
+    parts.append((operator, ucum_str[start:]))
+
+    return_list = []
+    for operator, part in parts:
+        if not part:
+            return None
+        # Numeric factors e.g., '1000' are kept whole
+        if part.isdigit():
+            symbol, exponent = part, 1
+        else:
+            match = ucum_component_regex.match(part)
+            if not match:
+                return None
+            symbol = match.group(1)
+            exponent = int(match.group(2)) if match.group(2) else 1
+        if invert or operator == '/':
+            exponent = -exponent
+        return_list.append((symbol, exponent))
+    return return_list
+
+
+# --------------------------------------------------
+def canonical_ucum_key(ucum_str):
+    """
+    Canonical form of any UCUM string matching canonical_ucum_code()
+    numerators then denominators each sorted alphabetically joined by "."
+    E.g., 'm/s', 's-1.m' and 'm.s-1' -> 'm.s-1'
+    Returns None if the string can't be split into components
+    """
+    components = split_ucum_str(ucum_str)
+    if components is None:
+        return None
+    components.sort(key=lambda c: (c[0].casefold(), c[0], c[1]))
+    return_lst = []
+    for symbol, exponent in components:
+        if exponent >= 0:
+            return_lst.append(symbol if exponent == 1 else symbol + str(exponent))
+    for symbol, exponent in components:
+        if exponent < 0:
+            return_lst.append(symbol + str(exponent))
+    return '.'.join(return_lst)
+
+
 # --------------------------------------------------
 def lookahead(iterable):
     """Pass through all values from the given iterable, augmented by the
@@ -565,18 +589,32 @@ def lookahead(iterable):
 
 
 # --------------------------------------------------
-def temp_ucum_map(ucum_list, ontology_mapping_list):
+def build_mapping_index(ontology_mapping_list):
     """
-    Temporary lookup to UCUM to ontology mappings. Later version will use the phase 2
-    UCUM parser to parse the UCUM mappings (first column at least) and convert those to
-    canonical UCUM string via our function to do so, then look those up based on input
+    Index the ontology to UCUM mappings once at load time by canonical UCUM key
+    so any component order or "/" form used in the mapping files is found with a
+    single lookup of the canonical code of the input.
+    Returns a dict of canonical UCUM key -> list of IRIs using it (in mapping file order)
     """
-    return_list = []
-    for u in ucum_list:
-        for x in ontology_mapping_list:
-            if u == x['UCUM1'] or u == x['UCUM2'] or u == x['UCUM3'] or u == x['UCUM4']:
-                return_list.append(x['IRI'])
-    return return_list
+    mapping_index = {}
+    for x in ontology_mapping_list:
+        # A row only counts once per key even if it lists several forms of it
+        key_set = set()
+        for u in [x.get('UCUM1'), x.get('UCUM2'), x.get('UCUM3'), x.get('UCUM4')]:
+            key = canonical_ucum_key(u)
+            if key is not None:
+                key_set.add(key)
+        for key in key_set:
+            mapping_index.setdefault(key, []).append(x['IRI'])
+    return mapping_index
+
+
+# --------------------------------------------------
+def temp_ucum_map(ucum_code, mapping_index):
+    """
+    Lookup UCUM to ontology mappings for a canonical UCUM code
+    """
+    return list(mapping_index.get(canonical_ucum_key(ucum_code), []))
 
 
 # --------------------------------------------------
@@ -682,25 +720,13 @@ def main():
         for row in reader:
             SI_list.append(row)
 
-    SI_NC_units_dict = {}
-    for i in SI_list:
-        SI_NC_units_dict[i['SI_symbol']] = i['NC_symbol']
-
-    SI_SI_can_units_dict = {}
-    for i in SI_list:
-        SI_SI_can_units_dict[i['SI_symbol']] = i['SI_symbol_canonical']
-
-    SI_UCUM_units_dict = {}
-    for i in SI_list:
-        SI_UCUM_units_dict[i['SI_symbol']] = i['UCUM_symbol']
-
-    SI_unit_label_en_dict = {}
-    for i in SI_list:
-        SI_unit_label_en_dict[i['SI_symbol']] = i['label_en']
-
-    SI_unit_def_en_dict = {}
-    for i in SI_list:
-        SI_unit_def_en_dict[i['SI_symbol']] = i['definition_en']
+    # Load the SI units, keyed by SI symbol, into the vocab registry
+    vocab = VocabRegistry()
+    vocab.add_table('unit_nc_code', SI_list, 'SI_symbol', 'NC_symbol')
+    vocab.add_table('unit_si_code', SI_list, 'SI_symbol', 'SI_symbol_canonical')
+    vocab.add_table('unit_ucum_code', SI_list, 'SI_symbol', 'UCUM_symbol')
+    vocab.add_table('unit_label_en', SI_list, 'SI_symbol', 'label_en')
+    vocab.add_table('unit_definition_en', SI_list, 'SI_symbol', 'definition_en')
 
     # Read in SI prefixes
     prefix_list = []
@@ -710,13 +736,8 @@ def main():
         for row in reader:
             prefix_list.append(row)
 
-    prefix_en_dict = {}
-    for i in prefix_list:
-        prefix_en_dict[i['symbol']] = i['label_en']
-
-    prefix_numbers_dict = {}
-    for i in prefix_list:
-        prefix_numbers_dict[i['symbol']] = i['prefix_num']
+    vocab.add_table('prefix_label_en', prefix_list, 'symbol', 'label_en')
+    vocab.add_table('prefix_num', prefix_list, 'symbol', 'prefix_num')
 
     # Read in powers
     exponents_list = []
@@ -726,9 +747,7 @@ def main():
         for row in reader:
             exponents_list.append(row)
 
-    exponents_en_dict = {}
-    for i in exponents_list:
-        exponents_en_dict[i['power']] = i['label_en']
+    vocab.add_table('exponent_label_en', exponents_list, 'power', 'label_en')
 
     ###### Mappings #######################################
     # Read in ontology to UCUM mappings
@@ -762,6 +781,8 @@ def main():
 
     # Join all the input ontology to UCUM mappings into single list of dict
     ontology_mapping_list = om_ucum_list + qudt_ucum_list + uo_ucum_list + oboe_ucum_list
+    # Index mappings by UCUM string for constant time lookups
+    mapping_index = build_mapping_index(ontology_mapping_list)
     #print(ontology_mapping_list)
 
     # test_list = ["cm", "m.s", "m/s", "/g", "K2", "s-1", "m/s/T", "N/Wb/W", "Gy2.lm.lx-1"]
@@ -782,15 +803,17 @@ def main():
     # test_list = ['mm2.Gg.pW-2.yA-1']
     test_list = ['m.s-1', 'asdf']
 
-    valid_SI_input_list = []
+    # Parse each input once, keeping the transformed result for the conversion below
+    si_transformer = transformer()
+    parsed_input_list = []
 
     # # breakup input list one term at a time
     for u in input_list:
     # for u in test_list:
         try:
             tree = si_grammar.parse(u)
-            result = transformer().transform(tree)
-            valid_SI_input_list.append(u)
+            result = si_transformer.transform(tree)
+            parsed_input_list.append((u, result))
         except:
             print(f"Could not process '{u}' with SI parser")
 
@@ -807,9 +830,7 @@ def main():
 
 
 
-    for u in valid_SI_input_list:
-        tree = si_grammar.parse(u)
-        result = transformer().transform(tree)
+    for u, result in parsed_input_list:
         res_flat = flatten(result)
         # print(u, res_flat)
 
@@ -821,23 +842,18 @@ def main():
         # Add codes to dict:
         for r in new_dict_list:
             # Create the NCname code from prefix and unit
-            gen_symbol_code(result=r, mapping_dict=SI_NC_units_dict, code_str='nc_code' )
+            gen_symbol_code(result=r, vocab=vocab, table='unit_nc_code', code_str='nc_code')
             # create the SI code from prefix and unit
-            gen_symbol_code(result=r, mapping_dict=SI_SI_can_units_dict, code_str='si_code')
+            gen_symbol_code(result=r, vocab=vocab, table='unit_si_code', code_str='si_code')
             # create the UCUM codes from prefix and unit
-            gen_symbol_code(result=r, mapping_dict=SI_NC_units_dict, code_str='ucum_code')
+            gen_symbol_code(result=r, vocab=vocab, table='unit_nc_code', code_str='ucum_code')
 
         # print(u, new_dict_list)
 
-        # Function to generate list of UCUM codes from results dict list
-        # Permute Possible UCUM strings
-        UCUM_SI_list = gen_si_ucum_list(dict_list=new_dict_list)
-        #print(UCUM_SI_list)
-
         # Function to create labels from units and prefixes
-        # pass in desired language SI unit, prefix and exponents dicts + label_lan
+        # pass in the vocab registry + desired label_lan
         for r in new_dict_list:
-            gen_label_parts(result=r, SI_unit_label_dict=SI_unit_label_en_dict, prefix_dict=prefix_en_dict, exponents_dict=exponents_en_dict, label_lan='label_en')
+            gen_label_parts(result=r, vocab=vocab, label_lan='label_en')
         # print(u, new_dict_list)
 
         # Function to split numerator and denominator into two lists
@@ -861,10 +877,9 @@ def main():
         label = canonical_nc_label(numerator_list=numerator_list, denominator_list=denominator_list, label_lan='label_en')
 
         # Generate canonical english definition
-        # SI_unit_def_en_dict
         # TODO/WORKING
         definition_en = canonical_en_definition(numerator_list=numerator_list, denominator_list=denominator_list,
-                                                unit_def_dict=SI_unit_def_en_dict, prefix_numbers_dict=prefix_numbers_dict, SI_unit_label_en_dict=SI_unit_label_en_dict, exponents_en_dict=exponents_en_dict, label_lan='label_en')
+                                                vocab=vocab, label_lan='label_en')
         #print(definition_en)
 
         # Generate canonical SI code e.g. `Pa s`
@@ -877,8 +892,7 @@ def main():
         #print(ucum_code)
 
         # Map UCUM codes to external Ontologies
-        # LATER TODO change this to use the mappings of canonical UCUM strings by calling phase 2 on Simon’s mappings
-        mapping_list = temp_ucum_map(ucum_list=UCUM_SI_list, ontology_mapping_list=ontology_mapping_list)
+        mapping_list = temp_ucum_map(ucum_code=ucum_code, mapping_index=mapping_index)
         #print(mapping_list)
 
         # Format ttl for SI parser results
@@ -28,10 +28,15 @@ Demo run:
 """
 
 import argparse
+import os
 import sys
 import csv
 import re
 
+# VocabRegistry and ResultCache are shared with the other scripts, see shared/unit_tools.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'shared'))
+from unit_tools import ResultCache, VocabRegistry
+
 # Global Variables
 
 prefix_dict_list = [
@@ -115,6 +120,11 @@ def get_args():
         type=str,
         default='')
 
+    parser.add_argument(
+        '--no-cache',
+        help='Convert every code instead of reusing Turtle blocks cached in .cache/ by earlier runs',
+        action='store_true')
+
     return parser.parse_args()
 
 
@@ -144,19 +154,25 @@ def lookahead(iterable):
 
 
 # --------------------------------------------------
-def get_key(val, dict):
-    for key, value in dict.items():
-        if val == value:
-            return key
-    return "key doesn't exist"
-
+def build_qname_vocab(qname_mapping_list):
+    """
+    Load the qname unit and prefix labels, qname to UCUM symbols and exponent labels
+    into a VocabRegistry, built once and shared by all the qname conversions
+    """
+    # Use one table with unit qname symbols as keys and english labels as values
+    # and a second table with prefix qname symbols as keys and english labels as values
+    unit_list = [i for i in qname_mapping_list if i['prefix'] == 'FALSE']
+    prefix_list = [i for i in qname_mapping_list if i['prefix'] == 'TRUE']
+    powers_dict = {'1': None, '2': 'square', '3': 'cubic', '4': 'quartic', '5': 'quintic', '6': 'sextic', '7': 'septic',
+                   '8': 'octic', '9': 'nonic', '10': 'decic'}
 
-# --------------------------------------------------
-def get_value(key, dict):
-    for k, value in dict.items():
-        if k == key:
-            return value
-    return None
+    vocab = VocabRegistry()
+    vocab.add_table('unit_label_en', unit_list, 'qname', 'label_en')
+    vocab.add_table('prefix_label_en', prefix_list, 'qname', 'label_en')
+    # Reverse of this table maps UCUM symbols back to qname symbols
+    vocab.add_table('unit_ucum', unit_list, 'qname', 'ucum')
+    vocab.add_dict('exponent_label_en', powers_dict)
+    return vocab
 
 
 # --------------------------------------------------
@@ -199,20 +215,20 @@ def extract_qname_symbol(in_str, unit_keys):
 
 
 # --------------------------------------------------
-def extract_label(in_str, unit_keys, prefix_dict, units_dict):
+def extract_label(in_str, vocab):
     """given qsymbol string will return its label
      e.g. given mmol will return millimole
      """
     # Call function to extract base symbol
-    unit_symbol = extract_qname_symbol(in_str, unit_keys)
+    unit_symbol = extract_qname_symbol(in_str, vocab.keys('unit_label_en'))
 
     if unit_symbol is not None:
         match = re.search("(.*)({})".format(unit_symbol), in_str)
-        unit = get_value(key=match.group(2), dict=units_dict)
+        unit = vocab.value('unit_label_en', match.group(2))
         if match.group(1) is '':
             return '{}'.format(unit)
         else:
-            prefix = get_value(key=match.group(1), dict=prefix_dict)
+            prefix = vocab.value('prefix_label_en', match.group(1))
         if prefix is None:
             pass
         else:
@@ -222,13 +238,13 @@ def extract_label(in_str, unit_keys, prefix_dict, units_dict):
 
 
 # --------------------------------------------------
-def extract_label_with_symbol(in_str, unit_keys, prefix_dict, units_dict, powers_dict):
+def extract_label_with_symbol(in_str, vocab):
     """Given strings like ng1 or L3 return nanogram or cubic litre"""
     match = re.search("(.*)(\d)", in_str)
     symbols = match.group(1)
     power = match.group(2)
-    symb_label = extract_label(symbols, unit_keys, prefix_dict, units_dict)
-    power_label = get_value(key=power, dict=powers_dict)
+    symb_label = extract_label(symbols, vocab)
+    power_label = vocab.value('exponent_label_en', power)
     if power_label is None:
         return '{}'.format(symb_label)
     else:
@@ -236,42 +252,24 @@ def extract_label_with_symbol(in_str, unit_keys, prefix_dict, units_dict, powers
 
 
 # --------------------------------------------------
-def gen_qname_label(qname_str, qname_mapping_list):
+def gen_qname_label(qname_str, vocab):
     """
     Perhaps here we can call a function that assembles the label based on the qname_str
-    # To do this I'll need to load in files with mappings between base terms labels and qname strings
-    # will need to pass above mapping file(s) to qname as additional arg(s)
+    Labels for the base terms come from the vocab registry built by build_qname_vocab()
     """
-    # Use one dict with unit qname symbols as keys and english labels as values
-    # and a second dict with prefix qname symbols as keys and english labels as values
-    # https://www.guru99.com/python-dictionary-append.html
-    units_dict = {}
-    for i in qname_mapping_list:
-        if i['prefix'] == 'FALSE':
-            units_dict[i['qname']] = i['label_en']
-    prefix_dict = {}
-    for i in qname_mapping_list:
-        if i['prefix'] == 'TRUE':
-            prefix_dict[i['qname']] = i['label_en']
-    unit_keys = list(units_dict.keys())
-    powers_dict = {'1': None, '2': 'square', '3': 'cubic', '4': 'quartic', '5': 'quintic', '6': 'sextic', '7': 'septic',
-                   '8': 'octic', '9': 'nonic', '10': 'decic'}
-
     # QName string has no "." separators
     if '.' not in qname_str:
         # Case with denominators and digits
         if '-' in qname_str:
             dash_free_qname = qname_str.replace('-', '', 1)
-            lab = extract_label_with_symbol(in_str=dash_free_qname, unit_keys=unit_keys, prefix_dict=prefix_dict,
-                                            units_dict=units_dict, powers_dict=powers_dict)
+            lab = extract_label_with_symbol(in_str=dash_free_qname, vocab=vocab)
             return 'reciprocal {}'.format(lab)
         # Case with digits
         elif any(c.isdigit() for c in qname_str):
-            return extract_label_with_symbol(in_str=qname_str, unit_keys=unit_keys, prefix_dict=prefix_dict,
-                                             units_dict=units_dict, powers_dict=powers_dict)
+            return extract_label_with_symbol(in_str=qname_str, vocab=vocab)
         # Case without denominators or digits
         else:
-            return extract_label(qname_str, unit_keys, prefix_dict, units_dict)
+            return extract_label(qname_str, vocab)
     else:
         unit_parts_list = qname_str.split('.')
         # Case 1 all numerators
@@ -279,10 +277,9 @@ def gen_qname_label(qname_str, qname_mapping_list):
             names_list = []
             for x in unit_parts_list:
                 if any(c.isdigit() for c in x):
-                    label = extract_label_with_symbol(in_str=x, unit_keys=unit_keys, prefix_dict=prefix_dict,
-                                                      units_dict=units_dict, powers_dict=powers_dict)
+                    label = extract_label_with_symbol(in_str=x, vocab=vocab)
                 else:
-                    label = extract_label(x, unit_keys, prefix_dict, units_dict)
+                    label = extract_label(x, vocab)
                 names_list.append(label)
             return ' '.join(names_list)
         # Case 2 if all denominators
@@ -290,8 +287,7 @@ def gen_qname_label(qname_str, qname_mapping_list):
             names_list = []
             for x in unit_parts_list:
                 dash_free_qname = x.replace('-', '', 1)
-                label = extract_label_with_symbol(in_str=dash_free_qname, unit_keys=unit_keys, prefix_dict=prefix_dict,
-                                                  units_dict=units_dict, powers_dict=powers_dict)
+                label = extract_label_with_symbol(in_str=dash_free_qname, vocab=vocab)
                 names_list.append(label)
             return 'reciprocal ' + ' '.join(names_list)
         # Case 3 Mix Numerators and denominators
@@ -307,76 +303,66 @@ def gen_qname_label(qname_str, qname_mapping_list):
             num_names_list = []
             for x in num_list:
                 if any(c.isdigit() for c in x):
-                    label = extract_label_with_symbol(in_str=x, unit_keys=unit_keys, prefix_dict=prefix_dict,
-                                                      units_dict=units_dict, powers_dict=powers_dict)
+                    label = extract_label_with_symbol(in_str=x, vocab=vocab)
                 else:
-                    label = extract_label(x, unit_keys, prefix_dict, units_dict)
+                    label = extract_label(x, vocab)
                 num_names_list.append(label)
 
             denom_names_list = []
             for x in denom_list:
                 dash_free_qname = x.replace('-', '', 1)
-                label = extract_label_with_symbol(in_str=dash_free_qname, unit_keys=unit_keys, prefix_dict=prefix_dict,
-                                                  units_dict=units_dict, powers_dict=powers_dict)
+                label = extract_label_with_symbol(in_str=dash_free_qname, vocab=vocab)
                 denom_names_list.append(label)
             return ' '.join(num_names_list) + ' per ' + ' '.join(denom_names_list)
 
 
 # --------------------------------------------------
-def ucum_str_to_qname_str(in_str, unit_keys, qname_ucum_map_dict):
+def ucum_str_to_qname_str(in_str, qname_ucum_map_dict):
     """
     convert just % to PCT
     Might need to update the regex string as new qname/UCUM mappings are made
     """
     match = re.search(r"^([a-zA-Z%#_']+)([-]?[0-9]{0,2})$", in_str)
     code = match.group(1)
-    ucum_code_symbol = extract_qname_symbol(code, unit_keys)
-    qname_code = get_value(ucum_code_symbol, qname_ucum_map_dict)
+    ucum_code_symbol = extract_qname_symbol(code, qname_ucum_map_dict)
+    qname_code = qname_ucum_map_dict.get(ucum_code_symbol)
     qstr_out = in_str.replace(ucum_code_symbol, qname_code)
     return qstr_out
 
 
 # --------------------------------------------------
-def ucum_to_qname(in_str, qname_mapping_list):
+def ucum_to_qname(in_str, vocab):
     """
     Function to convert UCUM strings to Qname string
     e.g. `%` to `PCT`
     """
-    qname_ucum_map_dict = {}
-    for i in qname_mapping_list:
-        if i['prefix'] == 'FALSE':
-            qname_ucum_map_dict[i['ucum']] = i['qname']
-    unit_keys = list(qname_ucum_map_dict.keys())
+    qname_ucum_map_dict = vocab.reverse['unit_ucum']
 
     if '.' not in in_str:
-        return ucum_str_to_qname_str(in_str, unit_keys, qname_ucum_map_dict)
+        return ucum_str_to_qname_str(in_str, qname_ucum_map_dict)
     else:
         unit_parts_list = in_str.split('.')
         new_list = []
         for x in unit_parts_list:
-            new_list.append(ucum_str_to_qname_str(x, unit_keys, qname_ucum_map_dict))
+            new_list.append(ucum_str_to_qname_str(x, qname_ucum_map_dict))
         return '.'.join(new_list)
 
 
 # --------------------------------------------------
-def qname_to_ucum(in_str, qname_mapping_list):
+def qname_to_ucum(in_str, vocab):
     """
     Function to convert Qname strings to UCUM string
     e.g.`PCT` to `%`
     """
-    qname_ucum_map_dict = {}
-    for i in qname_mapping_list:
-        if i['prefix'] == 'FALSE':
-            qname_ucum_map_dict[i['qname']] = i['ucum']
-    unit_keys = list(qname_ucum_map_dict.keys())
+    qname_ucum_map_dict = vocab.forward['unit_ucum']
 
     if '.' not in in_str:
-        return ucum_str_to_qname_str(in_str, unit_keys, qname_ucum_map_dict)
+        return ucum_str_to_qname_str(in_str, qname_ucum_map_dict)
     else:
         unit_parts_list = in_str.split('.')
         new_list = []
         for x in unit_parts_list:
-            new_list.append(ucum_str_to_qname_str(x, unit_keys, qname_ucum_map_dict))
+            new_list.append(ucum_str_to_qname_str(x, qname_ucum_map_dict))
         return '.'.join(new_list)
 
 
@@ -485,7 +471,7 @@ def get_ucum_dash_str(in_str):
 
 # --------------------------------------------------
 def qname(in_str, ontology_mapping_list, om_ucum_list, qudt_ucum_list, uo_ucum_list, oboe_ucum_list,
-          qname_mapping_list):
+          vocab):
     """Parse input mappings to find UCUM, QUDT, OM, UO IDs/strings.
     For now we're assuming that the in_str has been checked to be a correct "UCUM" style string
     Will need to add such a check prior to passing in_str into this qname function.
@@ -498,11 +484,11 @@ def qname(in_str, ontology_mapping_list, om_ucum_list, qudt_ucum_list, uo_ucum_l
     oboe_iri = ''
 
     # Convert UCUM style in_str to a proper QName str
-    qname_str = ucum_to_qname(in_str, qname_mapping_list)
+    qname_str = ucum_to_qname(in_str, vocab)
     # Generate label from qname str
-    qname_label = gen_qname_label(qname_str, qname_mapping_list)
+    qname_label = gen_qname_label(qname_str, vocab)
     # Map ucum string to QName
-    ucum_from_qname = qname_to_ucum(qname_str, qname_mapping_list)
+    ucum_from_qname = qname_to_ucum(qname_str, vocab)
 
     # This works but it's a bit big
     for x in ontology_mapping_list:
@@ -757,6 +743,9 @@ def main():
         for row in reader:
             qname_mapping_list.append(row)
 
+    # Build the qname label and UCUM lookup tables once for all inputs
+    vocab = build_qname_vocab(qname_mapping_list)
+
     # Open outfile
     f = open(out_file, mode='w', encoding='utf-8-sig')
 
@@ -772,6 +761,14 @@ def main():
     # Sort alphabetically
     input_list.sort()
 
+    # Reuse Turtle blocks from earlier runs with the same mapping files
+    cache = None
+    cached = {}
+    if not args.no_cache:
+        cache = ResultCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'qname_results.sqlite'),
+                            os.path.abspath(__file__), [om_ucum, qudt_ucum, uo_ucum, oboe_ucum, qname_mapping])
+        cached = cache.get_many(input_list)
+
     for i in input_list:
         # get qname string label
         # TODO write a function similar to modify gen_qname_label()
@@ -781,12 +778,22 @@ def main():
         # Calling qname on the whole list as to make sure we have a list of unique qnames prior to printing a new one
 
         # Perhaps not the best way to handle the None values returned from the previous functions
-        call = qname(in_str=i, ontology_mapping_list=ontology_mapping_list, om_ucum_list=om_ucum_list, qudt_ucum_list=qudt_ucum_list,
-                     uo_ucum_list=uo_ucum_list, oboe_ucum_list=oboe_ucum_list,
-                     qname_mapping_list=qname_mapping_list)
+        if i in cached:
+            call = cached[i]
+        else:
+            call = qname(in_str=i, ontology_mapping_list=ontology_mapping_list, om_ucum_list=om_ucum_list, qudt_ucum_list=qudt_ucum_list,
+                         uo_ucum_list=uo_ucum_list, oboe_ucum_list=oboe_ucum_list,
+                         vocab=vocab)
+            if cache is not None:
+                cache.put(i, call)
         if call is not None:
             print(call, file=f)
 
+    if cache is not None:
+        cache.commit()
+        cache.close()
+    f.close()
+
 
 # --------------------------------------------------
 if __name__ == '__main__':
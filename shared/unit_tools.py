@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Author : Kai
+Date   : 2026-10-18
+Purpose: Helpers shared by nc_name_script/nc_name.py, qname_processing/qname.py
+and qname_processing/SI_parser.py
+
+The scripts are run from their own directories, each puts this directory on
+sys.path before importing from here.
+
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+
+# --------------------------------------------------
+class VocabRegistry:
+    """
+    Lookup tables for unit, prefix and exponent symbols, loaded once per run.
+    Each table is kept as a forward dict (symbol -> value) and a reverse dict
+    (value -> symbol) so lookups in either direction are constant time.
+    """
+
+    def __init__(self):
+        self.forward = {}
+        self.reverse = {}
+
+    def add_table(self, name, rows, key_col, value_col):
+        """Add a table built from a list of csv row dicts, later rows win on repeated keys"""
+        table = {}
+        for row in rows:
+            table[row[key_col]] = row[value_col]
+        self.add_dict(name, table)
+
+    def add_dict(self, name, table):
+        """Add a table from an existing dict, the reverse keeps the first key for a value"""
+        reverse = {}
+        for key, value in table.items():
+            reverse.setdefault(value, key)
+        self.forward[name] = table
+        self.reverse[name] = reverse
+
+    def value(self, name, key):
+        """Return the value for key in table name or None"""
+        return self.forward[name].get(key)
+
+    def key(self, name, value):
+        """Return the first key holding value in table name or None"""
+        return self.reverse[name].get(value)
+
+    def keys(self, name):
+        """Return the keys of table name, supports constant time `in` checks"""
+        return self.forward[name].keys()
+
+
+# --------------------------------------------------
+def file_digest(path):
+    """sha256 of a file's contents"""
+    with open(path, mode='rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# --------------------------------------------------
+class ResultCache:
+    """
+    Conversion results kept across runs in a sqlite database, one json value per input
+    code. Keyed by a hash of the code and a hash of the converting script, this module,
+    every input dict and mapping file and the options the results depend on e.g. the
+    parser, so changing any of them invalidates the cache. Rows for other hashes are
+    dropped when the cache is opened
+    """
+
+    def __init__(self, path, script_file, input_files, options=()):
+        vocab_hash = hashlib.sha256()
+        for source_file in [os.path.abspath(__file__), script_file] + list(input_files):
+            vocab_hash.update(file_digest(source_file).encode('utf-8'))
+        vocab_hash.update(json.dumps(list(options)).encode('utf-8'))
+        self.vocab_hash = vocab_hash.hexdigest()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (vocab_hash TEXT, code_hash TEXT, '
+                                'value TEXT, PRIMARY KEY (vocab_hash, code_hash))')
+        self.connection.execute('DELETE FROM results WHERE vocab_hash != ?', (self.vocab_hash,))
+        self.connection.commit()
+
+    @staticmethod
+    def code_hash(code):
+        return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+    def get_many(self, codes):
+        """Return a dict of code to cached value for the codes found in the cache"""
+        hashes = {self.code_hash(code): code for code in codes}
+        hash_list = list(hashes)
+        values = {}
+        # Stay under sqlite's limit on query parameters
+        for i in range(0, len(hash_list), 500):
+            chunk = hash_list[i:i + 500]
+            rows = self.connection.execute(
+                'SELECT code_hash, value FROM results WHERE vocab_hash = ? AND code_hash IN ({})'.format(
+                    ','.join('?' * len(chunk))), [self.vocab_hash] + chunk)
+            for code_hash, value in rows:
+                values[hashes[code_hash]] = json.loads(value)
+        return values
+
+    def put(self, code, value):
+        """Store a json serializable value for code, written on the next commit()"""
+        self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                                (self.vocab_hash, self.code_hash(code), json.dumps(value, ensure_ascii=False)))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()